@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_PATH, "..", "src"))
+
+import argparse
+import json
+import logging
+import resource
+import subprocess
+import time
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ["grpc", "rest"]
+PROJECT_ID = "benchmark-project"
+
+
+def get_rss_kb():
+    with open("/proc/self/status") as status_file:
+        for line in status_file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(backend_name):
+    start_time = time.perf_counter()
+    baseline_rss_kb = get_rss_kb()
+
+    from firebase_credentials import FirebaseCredentials
+    from firestore_tunnels_handler import FirestoreTunnelsHandler
+    from state_backend import get_state_backend
+    handler_import_s = time.perf_counter() - start_time
+
+    backend_start_time = time.perf_counter()
+    backend = get_state_backend(backend_name)
+    backend_import_s = time.perf_counter() - backend_start_time
+
+    client_start_time = time.perf_counter()
+    credentials = FirebaseCredentials({"id_token": "benchmark-token"}, "benchmark-refresh-token", lambda: {})
+    client = backend.create_client(PROJECT_ID, credentials)
+    client.collection("users/benchmark-user/devices").document("benchmark-device")
+    if backend_name == "grpc":
+        # The channel is created lazily, build it as the first listener would
+        client._firestore_api
+    client_s = time.perf_counter() - client_start_time
+
+    return {"backend": backend_name,
+            "handler_import_s": handler_import_s,
+            "backend_import_s": backend_import_s,
+            "client_s": client_s,
+            "total_s": time.perf_counter() - start_time,
+            "baseline_rss_kb": baseline_rss_kb,
+            "rss_kb": get_rss_kb(),
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+def run_measurement(backend_name):
+    # Every backend is measured in a fresh interpreter, so the modules already
+    # imported by another backend are not shared
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--measure", backend_name],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def print_results(results):
+    print(f"{'backend':<8} {'handler (ms)':>13} {'backend (ms)':>13} {'client (ms)':>12} {'total (ms)':>11} "
+          f"{'RSS (MiB)':>10} {'max RSS (MiB)':>14}")
+    for result in results:
+        print(f"{result['backend']:<8} {result['handler_import_s']*1000:>13.1f} {result['backend_import_s']*1000:>13.1f} "
+              f"{result['client_s']*1000:>12.1f} {result['total_s']*1000:>11.1f} "
+              f"{result['rss_kb']/1024:>10.1f} {result['max_rss_kb']/1024:>14.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the startup time and the resident memory of every state backend")
+    parser.add_argument("backends", nargs="*", help=f"Backends to measure ({', '.join(BACKENDS)})")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    parser.add_argument("--runs", type=int, default=3, help="Measurements per backend, the fastest one is reported")
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure)))
+        return
+
+    backends = args.backends or BACKENDS
+    unknown_backends = [backend for backend in backends if backend not in BACKENDS]
+    if unknown_backends:
+        parser.error(f"unknown backends: {', '.join(unknown_backends)}")
+
+    results = [min((run_measurement(backend) for _ in range(args.runs)), key=lambda result: result["total_s"])
+               for backend in backends]
+    print_results(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import boringproxy_api.boringproxy_api
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class FakeBoringproxyServer:
+
+    def __init__(self, latency_s=0, failure_rate=0, seed=0):
+        self.latency_s = latency_s
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.clients = {}
+        self.tunnels = {}
+        self.request_count = 0
+        self.lock = threading.Lock()
+        self.http_server = None
+        self.server_thread = None
+
+    def start(self):
+        self.http_server = ThreadingHTTPServer(
+            ("127.0.0.1", 0), self._get_request_handler_class())
+        self.http_server.daemon_threads = True
+        self.server_thread = threading.Thread(
+            target=self.http_server.serve_forever, name="fake-boringproxy-api", daemon=True)
+        self.server_thread.start()
+        logger.debug(f"Fake boringproxy API listening on '{self.get_base_url()}'")
+
+    def stop(self):
+        if self.http_server:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
+
+    def get_base_url(self):
+        host, port = self.http_server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle_request(self, method, path, query, form):
+        with self.lock:
+            self.request_count += 1
+            failed = method == "POST" or path.startswith("/delete-")
+            failed = failed and self.random.random() < self.failure_rate
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        if failed:
+            return 500, "Internal server error"
+        with self.lock:
+            if method == "GET" and path == "/clients":
+                return 200, self._render_clients()
+            if method == "POST" and path == "/clients":
+                self.clients[form.get("client-name")] = form.get("owner")
+                return 200, ""
+            if method == "GET" and path == "/tunnels":
+                return 200, self._render_tunnels()
+            if method == "POST" and path == "/tunnels":
+                domain = form.get("domain")
+                if not domain or domain in self.tunnels:
+                    return 400, f"Domain '{domain}' already in use"
+                self.tunnels[domain] = {"owner": form.get("owner"), "client": form.get("client-name"),
+                                        "client_addr": form.get("client-addr"), "client_port": form.get("client-port")}
+                return 200, ""
+            if method == "GET" and path == "/delete-tunnel":
+                if self.tunnels.pop(query.get("domain"), None) is None:
+                    return 400, "Tunnel not found"
+                return 200, ""
+            if method == "GET" and path == "/delete-client":
+                self.clients.pop(query.get("client-name"), None)
+                return 200, ""
+        return 404, "Not found"
+
+    def _render_clients(self):
+        client_spans = [f'<span class="client">{escape(name)} (Owner: {escape(owner)})</span>'
+                        for name, owner in self.clients.items()]
+        return f"<html><body>{''.join(client_spans)}</body></html>"
+
+    def _render_tunnels(self):
+        tunnel_divs = []
+        for domain, tunnel in self.tunnels.items():
+            tunnel_divs.append(
+                '<div class="tn-tunnel-list-item">'
+                f'<div class="tn-attribute"><div class="tn-attribute__name">Domain:</div>'
+                f'<div class="tn-attribute__value"><a href="https://{escape(domain)}">{escape(domain)}</a></div></div>'
+                f'<div class="tn-attribute"><div class="tn-attribute__name">Client:</div>'
+                f'<div class="tn-attribute__value">{escape(tunnel["client"])}</div></div>'
+                f'<div class="tn-attribute"><div class="tn-attribute__name">Target:</div>'
+                f'<div class="tn-attribute__value">{escape(tunnel["client_addr"])}:{escape(tunnel["client_port"])}</div></div>'
+                '</div>')
+        return f"<html><body>{''.join(tunnel_divs)}</body></html>"
+
+    def _get_request_handler_class(self):
+        fake_server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                self._handle("GET", {})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length).decode()
+                self._handle("POST", {key: values[0] for key, values in parse_qs(body).items()})
+
+            def log_message(self, format, *args):
+                pass
+
+            def _handle(self, method, form):
+                url = urlsplit(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                status, body = fake_server.handle_request(method, url.path, query, form)
+                content = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+        return RequestHandler
+
+
+class RequestsRedirector:
+
+    def __init__(self, wrapped, base_url):
+        self.wrapped = wrapped
+        self.base_url = base_url
+        self.exceptions = wrapped.exceptions
+
+    def get(self, url, **kwargs):
+        return self.wrapped.get(self._rewrite(url), **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.wrapped.post(self._rewrite(url), **kwargs)
+
+    def _rewrite(self, url):
+        url_parts = urlsplit(url)
+        rewritten_url = f"{self.base_url}{url_parts.path}"
+        return f"{rewritten_url}?{url_parts.query}" if url_parts.query else rewritten_url
+
+
+def redirect_boringproxy_api(base_url):
+    api_module = boringproxy_api.boringproxy_api
+    original_requests = api_module.requests
+    api_module.requests = RequestsRedirector(original_requests, base_url)
+    return lambda: setattr(api_module, "requests", original_requests)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import ThreadPoolExecutor
+from firestore_tunnels_handler import FirestoreTunnelsHandler
+from types import SimpleNamespace
+import copy
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class FakeFirestoreClient:
+
+    def __init__(self):
+        self.documents = {}
+        self.watches = {}
+        self.write_callbacks = []
+        self.lock = threading.Lock()
+        self.watch_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="fake-firestore-watch")
+
+    def collection(self, path):
+        return FakeCollectionReference(self, path)
+
+    def add_write_callback(self, callback):
+        self.write_callbacks.append(callback)
+
+    def close(self):
+        self.watch_executor.shutdown(wait=True)
+
+    def get_document(self, path):
+        with self.lock:
+            return copy.deepcopy(self.documents.get(path))
+
+    def get_collection_documents(self, path):
+        with self.lock:
+            return {document_path: copy.deepcopy(data) for document_path, data in self.documents.items()
+                    if document_path.rsplit("/", 1)[0] == path}
+
+    def set_document(self, path, data):
+        with self.lock:
+            self.documents[path] = copy.deepcopy(data)
+        self._notify(path)
+
+    def update_document(self, path, updated_fields):
+        with self.lock:
+            document = self.documents.setdefault(path, {})
+            for field, value in updated_fields.items():
+                *parents, key = field.split(".")
+                node = document
+                for parent in parents:
+                    node = node.setdefault(parent, {})
+                node[key] = copy.deepcopy(value)
+        for callback in self.write_callbacks:
+            callback(path, updated_fields)
+        self._notify(path)
+
+    def add_watch(self, path, watch):
+        with self.lock:
+            self.watches.setdefault(path, []).append(watch)
+        self._notify(path)
+
+    def remove_watch(self, path, watch):
+        with self.lock:
+            if watch in self.watches.get(path, []):
+                self.watches[path].remove(watch)
+
+    def _notify(self, path):
+        with self.lock:
+            watches = self.watches.get(path, []) + self.watches.get(path.rsplit("/", 1)[0], [])
+        for watch in watches:
+            self.watch_executor.submit(watch.deliver, path.split("/")[-1])
+
+
+class FakeCollectionReference:
+
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+
+    def document(self, document_id):
+        return FakeDocumentReference(self.client, f"{self.path}/{document_id}")
+
+    def get_snapshots(self):
+        return [FakeDocumentSnapshot(document_path.split("/")[-1], data)
+                for document_path, data in self.client.get_collection_documents(self.path).items()]
+
+    def on_snapshot(self, callback):
+        watch = FakeWatch(self, callback)
+        self.client.add_watch(self.path, watch)
+        return watch
+
+
+class FakeDocumentReference:
+
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+        self.id = path.split("/")[-1]
+
+    def get(self):
+        return FakeDocumentSnapshot(self.id, self.client.get_document(self.path))
+
+    def get_snapshots(self):
+        snapshot = self.get()
+        return [snapshot] if snapshot.exists else []
+
+    def set(self, data):
+        self.client.set_document(self.path, data)
+
+    def update(self, updated_fields):
+        self.client.update_document(self.path, updated_fields)
+
+    def on_snapshot(self, callback):
+        watch = FakeWatch(self, callback)
+        self.client.add_watch(self.path, watch)
+        return watch
+
+
+class FakeDocumentSnapshot:
+
+    def __init__(self, document_id, data):
+        self.id = document_id
+        self.data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self.data)
+
+
+class FakeWatch:
+
+    def __init__(self, reference, callback):
+        self.reference = reference
+        self.callback = callback
+        self.on_activity = lambda: None
+
+    def unsubscribe(self):
+        self.reference.client.remove_watch(self.reference.path, self)
+
+    def deliver(self, changed_id):
+        self.on_activity()
+        snapshots = self.reference.get_snapshots()
+        changes = [SimpleNamespace(document=snapshot)
+                   for snapshot in snapshots if snapshot.id == changed_id]
+        if snapshots:
+            self.callback(snapshots, changes, time.time())
+
+
+class FakeStateBackend:
+
+    def __init__(self, fake_client):
+        self.fake_client = fake_client
+
+    def create_client(self, project_id, credentials):
+        return self.fake_client
+
+    def attach_liveness(self, subscription, liveness_monitor):
+        subscription.on_activity = liveness_monitor.touch
+
+
+class FakeFirestoreTunnelsHandler(FirestoreTunnelsHandler):
+
+    USER_ID = "benchmark-user"
+
+    def __init__(self, fake_client, device_id, tunnels_update_callback=lambda _: None):
+        super().__init__("fake-api-key", "fake-project", "fake-refresh-token",
+                         device_id, tunnels_update_callback, FakeStateBackend(fake_client))
+        self.fake_client = fake_client
+
+    def initialize_client(self, notify=True):
+        if not self.client:
+            self.user_id = self.USER_ID
+            self.client = self.backend.create_client(self.project_id, None)
+            self.liveness_monitor.arm()
+        if notify:
+            self.runtime.run_in_executor(self.on_client_initialized)
+
+    def get_device_document(self):
+        return self.fake_client.collection(f"users/{self.USER_ID}/devices").document(self.device_id)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_PATH, "..", "src"))
+
+from boringproxy_local_client import BoringproxyLocalClient
+from boringproxy_registry import BoringproxyRegistry
+from fake_boringproxy_api import FakeBoringproxyServer, redirect_boringproxy_api
+from fake_firestore import FakeFirestoreClient, FakeFirestoreTunnelsHandler
+from reconcile_worker import ReconcileWorker
+from runtime import get_runtime
+from tunnel_name_generator import TunnelNameGenerator
+from tunnels_handler import TunnelsHandler
+import argparse
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SERVICE_HOST = "benchmark.iomtunnels.local"
+SERVICE_TOKEN = "benchmark-token"
+USERNAME = "benchmark@example.com"
+DEVICE_ID = "benchmark-device"
+FAKE_BINARY_PATH = os.path.join(BENCHMARKS_PATH, "fake_boringproxy")
+PROVISIONING_MAX_WORKERS = 4
+WAIT_TIMEOUT_S = 60
+
+
+def get_percentile(samples, percentile):
+    if not samples:
+        return None
+    sorted_samples = sorted(samples)
+    index = max(0, math.ceil(percentile / 100 * len(sorted_samples)) - 1)
+    return sorted_samples[index]
+
+
+def create_tunnels(count, first_port=8000):
+    return {str(port): {"type": f"service-{port}"} for port in range(first_port, first_port + count)}
+
+
+class BenchmarkResult:
+
+    def __init__(self, name, duration_s, latencies_s, **details):
+        self.name = name
+        self.duration_s = duration_s
+        self.latencies_s = latencies_s
+        self.details = details
+
+    def get_row(self):
+        operations = len(self.latencies_s)
+        throughput = operations / self.duration_s if self.duration_s else 0
+        percentiles = [get_percentile(self.latencies_s, percentile)
+                       for percentile in (50, 90, 99, 100)]
+        details = " ".join(f"{key}={value}" for key, value in self.details.items())
+        return [self.name, str(operations), f"{self.duration_s:.3f}", f"{throughput:.1f}"] + \
+            [f"{value * 1000:.1f}" if value is not None else "-" for value in percentiles] + [details]
+
+
+class TunnelsEnvironment:
+
+    def __init__(self, latency_s=0, failure_rate=0):
+        self.server = FakeBoringproxyServer(latency_s, failure_rate)
+        self.restore_requests = None
+        self.handler = None
+        self.available_times = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.server.start()
+        self.restore_requests = redirect_boringproxy_api(self.server.get_base_url())
+        self.handler = TunnelsHandler(SERVICE_HOST, SERVICE_TOKEN, USERNAME, DEVICE_ID,
+                                      TunnelNameGenerator(USERNAME, DEVICE_ID), PROVISIONING_MAX_WORKERS,
+                                      BoringproxyRegistry())
+        self.handler.bp_local_client.binary_path = FAKE_BINARY_PATH
+        self.handler.add_tunnel_available_callback(self.on_tunnel_available)
+        self.handler.start()
+
+    def stop(self):
+        self.handler.stop()
+        self.restore_requests()
+        self.server.stop()
+
+    def on_tunnel_available(self, tunnel_info):
+        with self.lock:
+            self.available_times.setdefault(tunnel_info["port"], time.monotonic())
+
+
+def run_create_scenario(name, count, latency_s=0, failure_rate=0, max_rounds=20):
+    environment = TunnelsEnvironment(latency_s, failure_rate)
+    environment.start()
+    tunnels = create_tunnels(count)
+    rounds = 0
+    start_time = time.monotonic()
+    while rounds < max_rounds and len(environment.handler.active_tunnels) < count:
+        environment.handler.on_tunnels_update(tunnels)
+        rounds += 1
+    duration_s = time.monotonic() - start_time
+    latencies_s = [environment.available_times[port] - start_time
+                   for port in tunnels if port in environment.available_times]
+    requests_count = environment.server.request_count
+    environment.stop()
+    return BenchmarkResult(name, duration_s, latencies_s, rounds=rounds, api_requests=requests_count)
+
+
+def run_noop_scenario(name, count, iterations=50):
+    environment = TunnelsEnvironment()
+    environment.start()
+    tunnels = create_tunnels(count)
+    environment.handler.on_tunnels_update(tunnels)
+    for port, url in environment.handler.active_tunnels.items():
+        tunnels[port]["url"] = url
+    requests_count = environment.server.request_count
+    latencies_s = []
+    start_time = time.monotonic()
+    for _ in range(iterations):
+        reconcile_start_time = time.monotonic()
+        environment.handler.on_tunnels_update(tunnels)
+        latencies_s.append(time.monotonic() - reconcile_start_time)
+    duration_s = time.monotonic() - start_time
+    requests_count = environment.server.request_count - requests_count
+    environment.stop()
+    return BenchmarkResult(name, duration_s, latencies_s, api_requests=requests_count)
+
+
+def run_burst_scenario(name, count, interval_s=0.01, latency_s=0):
+    environment = TunnelsEnvironment(latency_s)
+    environment.start()
+    firestore_client = FakeFirestoreClient()
+    introduced_times, published_times = {}, {}
+    all_published = threading.Event()
+    reconcile_count = [0]
+
+    def on_write(path, updated_fields):
+        for field in updated_fields:
+            _, port, *key = field.split(".", 2)
+            if key == ["url"] and port in introduced_times:
+                published_times.setdefault(port, time.monotonic())
+        if len(published_times) == count:
+            all_published.set()
+
+    def reconcile(tunnels):
+        reconcile_count[0] += 1
+        environment.handler.on_tunnels_update(tunnels)
+
+    firestore_client.add_write_callback(on_write)
+    reconcile_worker = ReconcileWorker(reconcile, debounce_time_s=0.05)
+    firestore_handler = FakeFirestoreTunnelsHandler(
+        firestore_client, DEVICE_ID, reconcile_worker.submit)
+    environment.handler.add_tunnel_available_callback(
+        lambda tunnel_info: firestore_handler.update_tunnel_url(tunnel_info["port"], tunnel_info["url"]))
+    device_document = firestore_handler.get_device_document()
+    device_document.set({"tunnels": {}})
+    firestore_handler.start()
+    reconcile_worker.start()
+
+    start_time = time.monotonic()
+    for port, tunnel_info in create_tunnels(count).items():
+        introduced_times[port] = time.monotonic()
+        device_document.update({f"tunnels.{port}": tunnel_info})
+        time.sleep(interval_s)
+    if not all_published.wait(WAIT_TIMEOUT_S):
+        logger.error(f"Only {len(published_times)} of {count} tunnels were published")
+    duration_s = time.monotonic() - start_time
+    latencies_s = [published_times[port] - introduced_times[port] for port in published_times]
+
+    reconcile_worker.stop()
+    firestore_handler.stop()
+    firestore_handler.device_documents[DEVICE_ID].stop()
+    firestore_client.close()
+    environment.stop()
+    return BenchmarkResult(name, duration_s, latencies_s, snapshots=count, reconciles=reconcile_count[0])
+
+
+def run_local_client_scenario(name, iterations=5):
+    latencies_s = []
+    start_time = time.monotonic()
+    for _ in range(iterations):
+        connected = threading.Event()
+        local_client = BoringproxyLocalClient(
+            SERVICE_HOST, SERVICE_TOKEN, DEVICE_ID, FAKE_BINARY_PATH)
+        local_client.add_output_event_callback(
+            lambda event, _: event == "connected" and connected.set())
+        client_start_time = time.monotonic()
+        local_client.start()
+        if connected.wait(WAIT_TIMEOUT_S):
+            latencies_s.append(time.monotonic() - client_start_time)
+        local_client.stop()
+    duration_s = time.monotonic() - start_time
+    return BenchmarkResult(name, duration_s, latencies_s)
+
+
+SCENARIOS = {
+    "create_1": lambda: run_create_scenario("create_1", 1),
+    "create_10": lambda: run_create_scenario("create_10", 10),
+    "create_100": lambda: run_create_scenario("create_100", 100),
+    "noop_100": lambda: run_noop_scenario("noop_100", 100),
+    "burst_50": lambda: run_burst_scenario("burst_50", 50),
+    "slow_api_10": lambda: run_create_scenario("slow_api_10", 10, latency_s=0.05),
+    "failing_api_10": lambda: run_create_scenario("failing_api_10", 10, failure_rate=0.3),
+    "local_client_start": lambda: run_local_client_scenario("local_client_start"),
+}
+
+
+def print_results(results):
+    header = ["scenario", "ops", "time_s", "ops/s", "p50_ms", "p90_ms", "p99_ms", "max_ms", "details"]
+    rows = [header] + [result.get_row() for result in results]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(header))]
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Offline benchmarks of the tunnels reconcile path")
+    parser.add_argument("scenarios", nargs="*", metavar="scenario",
+                        help=f"scenarios to run, all of them by default ({', '.join(SCENARIOS)})")
+    parser.add_argument("--verbose", action="store_true", help="show the service logs")
+    args = parser.parse_args()
+    unknown_scenarios = [scenario for scenario in args.scenarios if scenario not in SCENARIOS]
+    if unknown_scenarios:
+        parser.error(f"unknown scenarios: {', '.join(unknown_scenarios)}")
+
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s - %(name)-16s - %(message)s',
+        level=logging.DEBUG if args.verbose else logging.CRITICAL)
+
+    runtime = get_runtime(PROVISIONING_MAX_WORKERS + 2)
+    results = []
+    for scenario in args.scenarios or SCENARIOS:
+        results.append(SCENARIOS[scenario]())
+    runtime.stop()
+    print_results(results)
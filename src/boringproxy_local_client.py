@@ -1,17 +1,30 @@
 #!/usr/bin/env python3
 
+from collections import deque
+from metrics import METRICS
+from runtime import get_runtime
 import logging
 import os
+import random
+import re
 import subprocess
-import threading
+import time
 
 
 logger = logging.getLogger(__name__)
 
+LOCAL_CLIENT_RESTARTS = METRICS.counter(
+    "iombian_tunnels_local_client_restarts_total", "Restarts of the boringproxy local client")
+
 
 class BoringproxyLocalClient:
 
     BINARY_NAME = "boringproxy"
+    OUTPUT_CHUNK_SIZE = 4096
+    STOP_TIMEOUT_S = 3
+    RESTART_BACKOFF_BASE_S = 1
+    RESTART_BACKOFF_MAX_S = 60
+    STABLE_UPTIME_S = 60
 
     def __init__(self, server_host, token, client_name, binary_path=None):
         self.server_host = server_host
@@ -19,8 +32,17 @@ class BoringproxyLocalClient:
         self.client_name = client_name
         self.binary_finder = BinaryFileFinder(self.BINARY_NAME)
         self.binary_path = binary_path if binary_path else self.binary_finder.get_binary_path()
+        self.runtime = get_runtime()
         self.process = None
-        self.output_checker_thread = None
+        self.process_start_time = None
+        self.stdout_fd = None
+        self.pid_fd = None
+        self.running = False
+        self.restart_timer = None
+        self.restart_count = 0
+        self.restart_attempt = 0
+        self.output_parser = BoringproxyOutputParser(self._on_output_event)
+        self.output_event_callback = None
 
     def start(self):
         logger.debug(f"Starting '{self.client_name}' boringproxy local client")
@@ -28,19 +50,13 @@ class BoringproxyLocalClient:
             logger.error(
                 "Binary file for boringproxy local client could not be found")
             return
-        command = [self.binary_path, "client",  "-server", self.server_host,
-                   "-token", self.token, "-client-name", self.client_name]
-        self.process = subprocess.Popen(
-            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        self.output_checker_thread = threading.Thread(
-            target=self.__output_checker)
-        self.output_checker_thread.daemon = True
-        self.output_checker_thread.start()
+        self.runtime.run_sync(self._start_supervision)
 
     def stop(self):
         logger.debug(f"Stopping '{self.client_name}' boringproxy local client")
-        if self.process:
-            self.process.terminate()
+        process = self.runtime.run_sync(self._stop_supervision)
+        if process:
+            self._terminate_process(process)
 
     def restart(self):
         logger.debug(
@@ -48,22 +64,195 @@ class BoringproxyLocalClient:
         self.stop()
         self.start()
 
-    def __output_checker(self):
-        line = ''
-        while self.process.returncode is None:
-            character = self.process.stdout.read(1).decode("utf-8")
-            line += character
-            if character == '\n':
-                logger.debug(line)
-                line = ''
-            if "Email address: " in line:
-                logger.info(
-                    "Email input detected, sending new line character to access the license")
+    def get_stats(self):
+        running = self.process is not None and self.process.poll() is None
+        uptime_s = time.monotonic() - self.process_start_time if running else 0
+        return {"running": running, "pid": self.process.pid if running else None,
+                "uptime_s": uptime_s, "restart_count": self.restart_count}
+
+    def add_output_event_callback(self, callback):
+        self.output_event_callback = callback
+
+    def get_output_lines(self):
+        return list(self.output_parser.lines)
+
+    def _on_output_event(self, event, line):
+        if event == BoringproxyOutputParser.EMAIL_PROMPT_EVENT:
+            logger.info(
+                "Email input detected, sending new line character to access the license")
+            try:
                 self.process.stdin.write(b'\n')
                 self.process.stdin.flush()
-                break
-            self.process.poll()
-        logger.debug("Output checker has finished")
+            except OSError as e:
+                logger.error(f"License prompt could not be answered: {e}")
+            return
+        logger.info(f"Boringproxy local client event '{event}': {line}")
+        if self.output_event_callback:
+            self.output_event_callback(event, line)
+
+    def _start_supervision(self):
+        if self.running:
+            logger.debug("Boringproxy local client already running")
+            return
+        self.running = True
+        self._spawn_process()
+
+    def _stop_supervision(self):
+        self.running = False
+        if self.restart_timer:
+            self.restart_timer.cancel()
+            self.restart_timer = None
+        self._detach_process()
+        return self.process
+
+    def _spawn_process(self):
+        command = [self.binary_path, "client",  "-server", self.server_host,
+                   "-token", self.token, "-client-name", self.client_name]
+        self.process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.process_start_time = time.monotonic()
+        self.stdout_fd = self.process.stdout.fileno()
+        os.set_blocking(self.stdout_fd, False)
+        self.runtime.loop.add_reader(self.stdout_fd, self._on_output_readable)
+        self.pid_fd = self._open_pid_fd()
+        if self.pid_fd is not None:
+            self.runtime.loop.add_reader(self.pid_fd, self._on_process_exit)
+
+    def _detach_process(self):
+        if self.stdout_fd is not None:
+            self.runtime.loop.remove_reader(self.stdout_fd)
+            self._read_output()
+            self.output_parser.flush()
+            self.stdout_fd = None
+        if self.pid_fd is not None:
+            self.runtime.loop.remove_reader(self.pid_fd)
+            os.close(self.pid_fd)
+            self.pid_fd = None
+
+    def _read_output(self):
+        while True:
+            try:
+                chunk = os.read(self.stdout_fd, self.OUTPUT_CHUNK_SIZE)
+            except BlockingIOError:
+                return True
+            except OSError as e:
+                logger.debug(f"Output checker stopped reading: {e}")
+                return False
+            if not chunk:
+                return False
+            self.output_parser.feed(chunk)
+
+    def _on_output_readable(self):
+        if self._read_output():
+            return
+        self.runtime.loop.remove_reader(self.stdout_fd)
+        if self.pid_fd is None:
+            process_exit = self.runtime.run_in_executor(self.process.wait)
+            process_exit.add_done_callback(
+                lambda _: self.runtime.call_soon(self._on_process_exit))
+
+    def _on_process_exit(self):
+        process = self.process
+        if self.stdout_fd is None and self.pid_fd is None:
+            return
+        self._detach_process()
+        returncode = process.wait()
+        process.stdout.close()
+        process.stdin.close()
+        if not self.running:
+            return
+        uptime_s = time.monotonic() - self.process_start_time
+        if uptime_s >= self.STABLE_UPTIME_S:
+            self.restart_attempt = 0
+        delay = self._get_restart_delay()
+        self.restart_attempt += 1
+        logger.error(
+            f"Boringproxy local client exited with code {returncode} after {uptime_s:.1f} seconds, restarting in {delay:.1f} seconds")
+        self.restart_timer = self.runtime.loop.call_later(
+            delay, self._restart_process)
+
+    def _restart_process(self):
+        self.restart_timer = None
+        if not self.running:
+            return
+        self.restart_count += 1
+        LOCAL_CLIENT_RESTARTS.inc()
+        logger.info(
+            f"Restarting '{self.client_name}' boringproxy local client (restart #{self.restart_count})")
+        self._spawn_process()
+
+    def _terminate_process(self, process):
+        if process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(self.STOP_TIMEOUT_S)
+            except subprocess.TimeoutExpired:
+                logger.warning(
+                    f"Boringproxy local client did not stop in {self.STOP_TIMEOUT_S} seconds, killing it")
+                process.kill()
+                process.wait()
+        process.stdout.close()
+        process.stdin.close()
+
+    def _get_restart_delay(self):
+        delay = min(self.RESTART_BACKOFF_MAX_S,
+                    self.RESTART_BACKOFF_BASE_S * 2 ** self.restart_attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _open_pid_fd(self):
+        if not hasattr(os, "pidfd_open"):
+            return None
+        try:
+            return os.pidfd_open(self.process.pid)
+        except OSError:
+            return None
+
+
+class BoringproxyOutputParser:
+
+    MAX_LINES = 200
+    MAX_LINE_LENGTH = 4096
+    EMAIL_PROMPT = b"Email address: "
+    EMAIL_PROMPT_EVENT = "email_prompt"
+    EVENT_PATTERNS = [
+        ("auth_failure", re.compile(r"unauthorized|invalid token|forbidden|\b40[13]\b", re.IGNORECASE)),
+        ("disconnected", re.compile(r"disconnected|connection (refused|reset|closed)|broken pipe|i/o timeout|no such host|unexpected EOF", re.IGNORECASE)),
+        ("connected", re.compile(r"connected to|connection established", re.IGNORECASE)),
+        ("tunnel_added", re.compile(r"(new|creat\w*|add\w*) tunnel", re.IGNORECASE)),
+    ]
+
+    def __init__(self, on_event=lambda *_: None, max_lines=MAX_LINES):
+        self.on_event = on_event
+        self.lines = deque(maxlen=max_lines)
+        self.pending = b""
+
+    def feed(self, chunk):
+        *lines, self.pending = (self.pending + chunk).split(b"\n")
+        for line in lines:
+            self._process_line(line)
+        if self.EMAIL_PROMPT in self.pending:
+            self._process_line(self.pending)
+            self.pending = b""
+        elif len(self.pending) > self.MAX_LINE_LENGTH:
+            self._process_line(self.pending)
+            self.pending = b""
+
+    def flush(self):
+        if self.pending:
+            self._process_line(self.pending)
+            self.pending = b""
+
+    def _process_line(self, raw_line):
+        line = raw_line.decode("utf-8", errors="replace").rstrip()
+        self.lines.append(line)
+        logger.debug(line)
+        if self.EMAIL_PROMPT in raw_line:
+            self.on_event(self.EMAIL_PROMPT_EVENT, line)
+            return
+        for event, pattern in self.EVENT_PATTERNS:
+            if pattern.search(line):
+                self.on_event(event, line)
+                return
 
 
 class BinaryFileFinder:
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+from boringproxy_api import BoringproxyUserAPI
+from boringproxy_local_client import BoringproxyLocalClient
+from http_transport import get_http_transport
+import boringproxy_api.boringproxy_api
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# The boringproxy API calls the requests module functions directly, they are
+# routed through the shared transport to reuse the connections to the server
+boringproxy_api.boringproxy_api.requests = get_http_transport()
+
+
+class BoringproxyRegistry:
+
+    def __init__(self):
+        self.user_apis = {}
+        self.local_clients = {}
+        self.lock = threading.Lock()
+
+    def get_user_api(self, service_host, username, service_token):
+        key = (service_host, username, service_token)
+        with self.lock:
+            entry = self.user_apis.setdefault(key, {"api": None, "lock": threading.Lock()})
+        with entry["lock"]:
+            if not entry["api"]:
+                entry["api"] = BoringproxyUserAPI(service_host, username, service_token)
+            return entry["api"]
+
+    def create_client(self, user_api, client_name):
+        key = (user_api.server_host, user_api.user_name, user_api.access_token)
+        with self.lock:
+            entry = self.user_apis.get(key)
+        if not entry:
+            return user_api.create_client(client_name)
+        with entry["lock"]:
+            return user_api.create_client(client_name)
+
+    def acquire_local_client(self, service_host, service_token, client_name):
+        key = (service_host, service_token, client_name)
+        with self.lock:
+            entry = self.local_clients.get(key)
+            if entry:
+                logger.debug(f"Sharing '{client_name}' boringproxy local client")
+                entry["references"] += 1
+                return entry["client"]
+            local_client = BoringproxyLocalClient(service_host, service_token, client_name)
+            self.local_clients[key] = {"client": local_client, "references": 1}
+            return local_client
+
+    def release_local_client(self, local_client):
+        key = (local_client.server_host, local_client.token, local_client.client_name)
+        with self.lock:
+            entry = self.local_clients.get(key)
+            if not entry or entry["client"] is not local_client:
+                return True
+            entry["references"] -= 1
+            if entry["references"]:
+                return False
+            del self.local_clients[key]
+            return True
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_boringproxy_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = BoringproxyRegistry()
+        return _registry
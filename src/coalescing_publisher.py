@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+from concurrent import futures
+from runtime import get_runtime
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class CoalescingPublisher:
+
+    FLUSH_TIME_S = 0.2
+    FLUSH_RETRY_TIME_S = 5
+    MAX_PENDING_UPDATES = 20
+
+    def __init__(self, flush_callback, flush_time_s=FLUSH_TIME_S, max_pending_updates=MAX_PENDING_UPDATES):
+        self.flush_callback = flush_callback
+        self.flush_time_s = flush_time_s
+        self.max_pending_updates = max_pending_updates
+        self.runtime = get_runtime()
+        self.pending_updates = {}
+        self.pending_publications = []
+        self.published_values = {}
+        self.flush_timer = None
+        self.lock = threading.Lock()
+
+    def publish(self, field, value):
+        return self.publish_all({field: value})
+
+    def publish_all(self, values):
+        # The returned future is done once every value (or a newer value of
+        # the same field) has been written
+        published = futures.Future()
+        with self.lock:
+            fields = set()
+            for field, value in values.items():
+                if field not in self.pending_updates and field in self.published_values and self.published_values[field] == value:
+                    logger.debug(f"'{field}' already published, ignoring update")
+                    continue
+                self.pending_updates[field] = value
+                fields.add(field)
+            if not fields:
+                published.set_result(True)
+                return published
+            self.pending_publications.append((fields, published))
+            flush_now = len(self.pending_updates) >= self.max_pending_updates
+            if not flush_now:
+                self._schedule_flush(self.flush_time_s)
+        if flush_now:
+            self.flush()
+        return published
+
+    def set_published_values(self, values):
+        with self.lock:
+            self.published_values = dict(values)
+
+    def flush(self):
+        with self.lock:
+            updates, self.pending_updates = self.pending_updates, {}
+            self._cancel_flush()
+        if not updates:
+            return
+        logger.debug(f"Flushing {len(updates)} coalesced updates")
+        if self.flush_callback(updates):
+            with self.lock:
+                self.published_values.update(updates)
+                # Fields queued again during the write are not published yet
+                written_fields = set(updates) - set(self.pending_updates)
+                completed = []
+                for fields, published in self.pending_publications:
+                    fields -= written_fields
+                    if not fields:
+                        completed.append(published)
+                self.pending_publications = [(fields, published) for fields, published in self.pending_publications
+                                             if fields]
+            for published in completed:
+                published.set_result(True)
+            return
+        logger.debug(
+            f"Updates could not be flushed, retrying in {self.FLUSH_RETRY_TIME_S} seconds")
+        with self.lock:
+            for field, value in updates.items():
+                self.pending_updates.setdefault(field, value)
+            self._schedule_flush(self.FLUSH_RETRY_TIME_S)
+
+    def stop(self):
+        with self.lock:
+            self._cancel_flush()
+
+    def _schedule_flush(self, delay_s):
+        if self.flush_timer:
+            return
+        self.flush_timer = self.runtime.call_later_in_executor(
+            delay_s, self.flush)
+
+    def _cancel_flush(self):
+        if self.flush_timer:
+            self.flush_timer.cancel()
+            self.flush_timer = None
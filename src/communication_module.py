@@ -1,6 +1,13 @@
 #!/usr/bin/env python3
 
+from collections import deque
+from concurrent import futures
+import itertools
+import json
 import logging
+import os
+import threading
+import time
 import zmq
 
 logger = logging.getLogger(__name__)
@@ -8,27 +15,160 @@ logger = logging.getLogger(__name__)
 
 class CommunicationModule(object):
 
-    def __init__(self, host="127.0.0.1", port=5555):
+    REQUEST_TIMEOUT_S = 10
+
+    def __init__(self, host="127.0.0.1", port=5555, request_timeout_s=REQUEST_TIMEOUT_S):
         self.host = host
         self.port = port
+        self.request_timeout_s = request_timeout_s
         self.context = zmq.Context()
-        self.socket = self.context.socket(zmq.REQ)
+        self.socket = None
+        self.request_ids = itertools.count()
+        self.pending_requests = {}
+        self.outgoing_requests = deque()
+        self.reset_requested = False
+        self.running = False
+        self.io_thread = None
+        self.lock = threading.Lock()
+        self.wakeup_reader, self.wakeup_writer = os.pipe()
+        os.set_blocking(self.wakeup_reader, False)
+        os.set_blocking(self.wakeup_writer, False)
 
     def start(self):
         logger.debug(
             f"Starting communication module ('{self.host}:{self.port}')")
-        self.socket.connect(f"tcp://{self.host}:{self.port}")
+        self.socket = self._create_socket()
+        self.running = True
+        self.io_thread = threading.Thread(
+            target=self.__io_loop, name="communication-module", daemon=True)
+        self.io_thread.start()
 
     def stop(self):
         logger.debug("Stopping communication module")
-        self.socket.close()
+        self.running = False
+        self._wakeup()
+        if self.io_thread:
+            self.io_thread.join()
+            self.io_thread = None
+        with self.lock:
+            for future, _ in self.pending_requests.values():
+                future.cancel()
+            self.pending_requests.clear()
+        if self.socket:
+            self.socket.close(linger=0)
+            self.socket = None
         self.context.term()
+        os.close(self.wakeup_reader)
+        os.close(self.wakeup_writer)
         logger.debug("Communication module stopped")
 
-    def execute_command(self, command, params=None):
+    def execute_command(self, command, params=None, timeout_s=None):
         if not command:
             logger.error("The command argument is required")
             return
-        self.socket.send_json({"command": command, "params": params})
-        response = self.socket.recv_json()
-        return response
+        request_id, future = self._send_request(command, params)
+        return self._wait_response(command, request_id, future, time.monotonic() + self._get_timeout(timeout_s))
+
+    def execute_commands(self, commands, timeout_s=None):
+        deadline = time.monotonic() + self._get_timeout(timeout_s)
+        requests = [(command, *self._send_request(command, None))
+                    for command in commands]
+        return [self._wait_response(command, request_id, future, deadline)
+                for command, request_id, future in requests]
+
+    def _get_timeout(self, timeout_s):
+        return self.request_timeout_s if timeout_s is None else timeout_s
+
+    def _send_request(self, command, params):
+        request_id = str(next(self.request_ids)).encode()
+        frames = [request_id, b"",
+                  json.dumps({"command": command, "params": params}).encode()]
+        future = futures.Future()
+        with self.lock:
+            self.pending_requests[request_id] = (future, frames)
+            self.outgoing_requests.append(frames)
+        self._wakeup()
+        return request_id, future
+
+    def _wait_response(self, command, request_id, future, deadline):
+        try:
+            return future.result(max(0, deadline - time.monotonic()))
+        except futures.TimeoutError:
+            logger.error(f"Command '{command}' timed out, resetting the socket")
+            with self.lock:
+                self.pending_requests.pop(request_id, None)
+                self.reset_requested = True
+            self._wakeup()
+        except futures.CancelledError:
+            logger.error(f"Command '{command}' cancelled")
+
+    def _wakeup(self):
+        try:
+            os.write(self.wakeup_writer, b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def _create_socket(self):
+        socket = self.context.socket(zmq.DEALER)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.connect(f"tcp://{self.host}:{self.port}")
+        return socket
+
+    def _reset_socket(self, poller):
+        poller.unregister(self.socket)
+        self.socket.close(linger=0)
+        self.socket = self._create_socket()
+        poller.register(self.socket, zmq.POLLIN)
+        with self.lock:
+            self.reset_requested = False
+            self.outgoing_requests = deque(
+                frames for _, frames in self.pending_requests.values())
+        logger.debug(
+            f"Socket reset, {len(self.outgoing_requests)} pending requests resent")
+
+    def _dispatch_response(self, frames):
+        if len(frames) != 3:
+            logger.warning(f"Malformed response received: {frames}")
+            return
+        request_id, _, payload = frames
+        with self.lock:
+            future, _ = self.pending_requests.pop(request_id, (None, None))
+        if not future:
+            logger.debug(f"Discarding late response for request {request_id}")
+            return
+        try:
+            future.set_result(json.loads(payload))
+        except ValueError as e:
+            future.set_exception(e)
+
+    def __io_loop(self):
+        poller = zmq.Poller()
+        poller.register(self.socket, zmq.POLLIN)
+        poller.register(self.wakeup_reader, zmq.POLLIN)
+        while self.running:
+            events = dict(poller.poll())
+            if self.wakeup_reader in events:
+                try:
+                    os.read(self.wakeup_reader, 4096)
+                except BlockingIOError:
+                    pass
+            if self.reset_requested:
+                self._reset_socket(poller)
+            while True:
+                with self.lock:
+                    if not self.outgoing_requests:
+                        break
+                    frames = self.outgoing_requests.popleft()
+                try:
+                    self.socket.send_multipart(frames, zmq.NOBLOCK)
+                except zmq.Again:
+                    with self.lock:
+                        self.outgoing_requests.appendleft(frames)
+                    break
+            while True:
+                try:
+                    frames = self.socket.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                self._dispatch_response(frames)
+        logger.debug("Communication module I/O loop has finished")
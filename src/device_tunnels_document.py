@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+from coalescing_publisher import CoalescingPublisher
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceTunnelsDocument:
+
+    KEYWORD = "tunnels"
+
+    def __init__(self, device_id, get_device_reference, tunnels_update_callback=lambda _: None):
+        self.device_id = device_id
+        self.get_device_reference = get_device_reference
+        self.tunnels_update_callback = tunnels_update_callback
+        self.tunnels_cache = None
+        self.tunnels_cache_lock = threading.Lock()
+        self.publisher = CoalescingPublisher(self._write_fields)
+
+    def update_tunnel_url(self, port, url):
+        return self.publisher.publish(f"{self.KEYWORD}.{port}.url", url)
+
+    def update_tunnels_status(self, tunnels_status):
+        # Writing a field of a removed port would create it again without a type
+        with self.tunnels_cache_lock:
+            ports = set(self.tunnels_cache or {})
+        self.publisher.publish_all({f"{self.KEYWORD}.{port}.{key}": value
+                                    for port, tunnel_status in tunnels_status.items() if port in ports
+                                    for key, value in tunnel_status.items()})
+
+    def stop(self):
+        self.publisher.stop()
+
+    def on_snapshot(self, device_info):
+        if not self.KEYWORD in device_info:
+            logger.warn(
+                f"'{self.KEYWORD}' information not available for device '{self.device_id}', creating the new field")
+            device_reference = self.get_device_reference(self.device_id)
+            if device_reference:
+                device_reference.update({f"{self.KEYWORD}": {}})
+            return
+
+        tunnels = device_info.get(self.KEYWORD)
+        self.publisher.set_published_values({f"{self.KEYWORD}.{port}.{key}": value
+                                             for port, tunnel_info in tunnels.items()
+                                             for key, value in tunnel_info.items()})
+
+        with self.tunnels_cache_lock:
+            if tunnels == self.tunnels_cache:
+                logger.debug(f"Tunnels information of device '{self.device_id}' has not changed")
+                return
+            self.tunnels_cache = tunnels
+        self.tunnels_update_callback(tunnels)
+
+    def _write_fields(self, updated_fields):
+        with self.tunnels_cache_lock:
+            if self.tunnels_cache is not None:
+                # Updates queued before a port was removed are dropped
+                updated_fields = {field: value for field, value in updated_fields.items()
+                                  if field.split(".", 2)[1] in self.tunnels_cache}
+        if not updated_fields:
+            return True
+        device_reference = self.get_device_reference(self.device_id)
+        if not device_reference:
+            logger.debug("Firebase client not ready, cannot update device fields")
+            return False
+        try:
+            device_reference.update(updated_fields)
+        except Exception as e:
+            logger.error(f"Fields of device '{self.device_id}' could not be updated: {e}")
+            return False
+        self._apply_to_tunnels_cache(updated_fields)
+        return True
+
+    def _apply_to_tunnels_cache(self, updated_fields):
+        with self.tunnels_cache_lock:
+            if self.tunnels_cache is None:
+                return
+            tunnels = {port: dict(tunnel_info)
+                       for port, tunnel_info in self.tunnels_cache.items()}
+            for field, value in updated_fields.items():
+                _, port, key = field.split(".", 2)
+                if port in tunnels:
+                    tunnels[port][key] = value
+            self.tunnels_cache = tunnels
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+from google.auth import exceptions
+from google.oauth2.credentials import Credentials
+import datetime
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class FirebaseCredentials(Credentials):
+
+    DEFAULT_EXPIRES_IN_S = 3600
+
+    def __init__(self, token_response, refresh_token, token_response_getter):
+        super().__init__(None, refresh_token)
+        self.token_response_getter = token_response_getter
+        self.refresh_lock = threading.Lock()
+        self._apply_token_response(token_response)
+
+    def refresh(self, request):
+        with self.refresh_lock:
+            token_response = self.token_response_getter()
+            if not token_response.get("id_token"):
+                raise exceptions.RefreshError(
+                    "Firebase ID token could not be refreshed")
+            self._apply_token_response(token_response)
+        logger.debug(
+            f"Firebase ID token refreshed, valid for {self.get_seconds_to_expiry():.0f} seconds")
+
+    def get_seconds_to_expiry(self):
+        return (self.expiry - datetime.datetime.utcnow()).total_seconds()
+
+    def _apply_token_response(self, token_response):
+        expires_in_s = int(token_response.get(
+            "expires_in", self.DEFAULT_EXPIRES_IN_S))
+        self.token = token_response.get("id_token")
+        self.expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=expires_in_s)
+        if token_response.get("refresh_token"):
+            self._refresh_token = token_response.get("refresh_token")
@@ -1,83 +1,93 @@
 #!/usr/bin/env python3
 
-from google.cloud.firestore import Client
-from google.cloud.firestore_v1 import watch
-from google.oauth2.credentials import Credentials
-import google.api_core
+from firebase_credentials import FirebaseCredentials
+from google.auth.exceptions import RefreshError
+from http_transport import get_http_transport
+from liveness_monitor import LivenessMonitor
+from metrics import METRICS
+from reconnect_scheduler import ReconnectScheduler
+from runtime import get_runtime
+from state_backend import get_state_backend
 import json
 import logging
-import requests
 import threading
-import time
 
 logger = logging.getLogger(__name__)
 
-watch._should_recover = lambda _: False
-watch._should_terminate = lambda _: True
+TOKEN_REFRESHES = METRICS.counter(
+    "iombian_tunnels_firestore_token_refreshes_total", "Firebase token id refreshes", ["result"])
+CLIENT_INITIALIZATIONS = METRICS.counter(
+    "iombian_tunnels_firestore_client_initializations_total", "Firestore client initializations", ["result"])
 
 
 class FirestoreClientHandler:
 
-    REFRESH_TOKEN_TIME_MIN = 58
-    INITIALIZATION_RETRY_TIME_MIN = 1
+    REFRESH_TOKEN_MARGIN_S = 300
+    REFRESH_TOKEN_RETRY_TIME_S = 30
     SERVER_RESPONSE_TIMEOUT_S = 60
 
-    def __init__(self, api_key, project_id, refresh_token):
+    def __init__(self, api_key, project_id, refresh_token, backend=None):
         self.api_key = api_key
         self.project_id = project_id
         self.refresh_token = refresh_token
-        self.token_expired_timer = None
-        self.initialization_retry_timer = None
-        self.server_responde_message_handler = None
+        self.backend = backend or get_state_backend()
+        self.runtime = get_runtime()
+        self.http_transport = get_http_transport()
+        self.token_refresh_timer = None
+        self.token_refresh_lock = threading.Lock()
+        self.credentials = None
+        self.reconnect_scheduler = ReconnectScheduler(self.restart)
+        self.liveness_monitor = LivenessMonitor(
+            timeout_s=self.SERVER_RESPONSE_TIMEOUT_S, on_timeout=self.on_server_not_responding)
         self.user_id = None
         self.client = None
 
     def initialize_client(self, notify=True):
         if self.client:
             if notify:
-                threading.Thread(
-                    target=self.on_client_initialized, daemon=True).start()
+                self.runtime.run_in_executor(self.on_client_initialized)
+            return
+        if self.reconnect_scheduler.is_scheduled():
+            # Clients are only created by the scheduled reconnect, so the
+            # backoff also applies to the token endpoint
+            logger.debug("Firestore client reconnect already scheduled, waiting for it")
             return
 
         logger.debug("Initializing Firestore client")
         creds = self._get_credentials()
 
         if not creds:
-            if self.initialization_retry_timer:
-                return
-            self.initialization_retry_timer = threading.Timer(
-                self.INITIALIZATION_RETRY_TIME_MIN*60.0, self.on_initialization_retry)
-            self.initialization_retry_timer.start()
+            CLIENT_INITIALIZATIONS.inc(result="failure")
+            self.reconnect_scheduler.request("initialization_failed")
             return
 
-        self.client = Client(self.project_id, creds)
+        self.credentials = creds
+        self.client = self.backend.create_client(self.project_id, creds)
+        CLIENT_INITIALIZATIONS.inc(result="success")
+        self.reconnect_scheduler.mark_connected()
         logger.debug("Firebase client initialized")
         if notify:
-            threading.Thread(target=self.on_client_initialized,
-                             daemon=True).start()
-        self.server_responde_message_handler = ServerResponseMessageHandler(
-            timeout_s=self.SERVER_RESPONSE_TIMEOUT_S, on_server_not_responding=self.on_server_not_responding)
-        google.api_core.bidi._LOGGER = BidiCustomLogger()
-        google.api_core.bidi._LOGGER.addHandler(
-            self.server_responde_message_handler)
-        self.token_expired_timer = threading.Timer(
-            self.REFRESH_TOKEN_TIME_MIN*60.0, self.on_token_expired)
-        self.token_expired_timer.start()
+            self.runtime.run_in_executor(self.on_client_initialized)
+        self.liveness_monitor.arm()
+        self._schedule_token_refresh(creds)
 
     def stop_client(self):
         logger.debug("Stopping Firestore client")
         self.client = None
-        if self.server_responde_message_handler:
-            self.server_responde_message_handler.stop()
-            self.server_responde_message_handler = None
-        if self.initialization_retry_timer:
-            self.initialization_retry_timer.cancel()
-            self.initialization_retry_timer.join()
-            self.initialization_retry_timer = None
-        if self.token_expired_timer:
-            self.token_expired_timer.cancel()
-            self.token_expired_timer.join()
-            self.token_expired_timer = None
+        self.liveness_monitor.disarm()
+        with self.token_refresh_lock:
+            if self.token_refresh_timer:
+                self.token_refresh_timer.cancel()
+                self.token_refresh_timer = None
+            self.credentials = None
+
+    def restart(self):
+        logger.debug("Restarting Firestore client")
+        self.stop_client()
+        self.initialize_client()
+
+    def get_reconnect_state(self):
+        return self.reconnect_scheduler.get_state()
 
     def on_client_initialized(self):
         logger.warning(
@@ -91,77 +101,66 @@ class FirestoreClientHandler:
         logger.warning(
             "This function should be overwritten by the child class")
 
-    def on_initialization_retry(self):
-        logger.warning("Retrying firebase client initialization...")
-        self.initialization_retry_timer = None
-        threading.Thread(target=self.initialize_client).start()
+    def on_token_refresh(self):
+        credentials = self.credentials
+        if not credentials:
+            return
+        try:
+            credentials.refresh(None)
+        except RefreshError as e:
+            TOKEN_REFRESHES.inc(result="failure")
+            if self.credentials is not credentials:
+                return
+            if credentials.expired:
+                logger.error(f"Firebase token id expired and could not be refreshed: {e}")
+                self.on_token_expired()
+                return
+            logger.warning(
+                f"Firebase token id could not be refreshed, retrying in {self.REFRESH_TOKEN_RETRY_TIME_S} seconds")
+            self._schedule_token_refresh(credentials, self.REFRESH_TOKEN_RETRY_TIME_S)
+            return
+        TOKEN_REFRESHES.inc(result="success")
+        logger.debug("Firebase token id refreshed in place")
+        self._schedule_token_refresh(credentials)
+
+    def _schedule_token_refresh(self, credentials, delay_s=None):
+        if delay_s is None:
+            delay_s = max(0, credentials.get_seconds_to_expiry() -
+                          self.REFRESH_TOKEN_MARGIN_S)
+        with self.token_refresh_lock:
+            # The client may have been stopped or restarted while refreshing
+            if self.credentials is not credentials:
+                logger.debug("Firebase credentials replaced, not scheduling their refresh")
+                return
+            if self.token_refresh_timer:
+                self.token_refresh_timer.cancel()
+            logger.debug(f"Firebase token id refresh scheduled in {delay_s:.0f} seconds")
+            self.token_refresh_timer = self.runtime.call_later_in_executor(
+                delay_s, self.on_token_refresh)
 
     def _get_credentials(self):
-        user_id, token_id = self._get_ids()
+        token_response = self._get_token_response()
+        user_id = token_response.get("user_id")
+        token_id = token_response.get("id_token")
         if not user_id or not token_id:
             logger.debug(f"Invalid user and token ids ({user_id}, {token_id})")
             return None
         self.user_id = user_id
-        creds = Credentials(token_id, self.refresh_token)
+        creds = FirebaseCredentials(
+            token_response, self.refresh_token, self._get_token_response)
         return creds
 
-    def _get_ids(self):
-        token_response = self._get_token_response()
-        user_id = token_response.get("user_id")
-        token_id = token_response.get("id_token")
-        return (user_id, token_id)
-
     def _get_token_response(self):
         request_ref = f"https://securetoken.googleapis.com/v1/token?key={self.api_key}"
         headers = {"content-type": "application/json; charset=UTF-8"}
         data = json.dumps({"grantType": "refresh_token",
                           "refreshToken": self.refresh_token})
         try:
-            response_object = requests.post(
+            response_object = self.http_transport.post(
                 request_ref, headers=headers, data=data)
-            return response_object.json()
+            token_response = response_object.json()
         except Exception as e:
             return {}
-
-
-class BidiCustomLogger(logging.Logger):
-
-    def __init__(self, name="google.api_core.bidi", level=logging.DEBUG):
-        super().__init__(name, level)
-
-
-class ServerResponseMessageHandler(logging.StreamHandler):
-
-    def __init__(self, timeout_s=60, on_server_not_responding=lambda _: None, server_response_msg="recved response.", watchdog_timeout_msg="watchdog timeout"):
-        super().__init__()
-        self.timeout_s = timeout_s
-        self.on_server_not_responding = on_server_not_responding
-        self.server_response_msg = server_response_msg
-        self.server_response_last_time = time.time()
-        self.watchdog_timeout_msg = watchdog_timeout_msg
-        self.not_responding_timer = None
-        self.setFormatter(logging.Formatter(
-            '%(asctime)s %(levelname)-8s - %(name)-16s - %(message)s', None, '%'))
-
-    def emit(self, record):
-        msg = self.format(record)
-        if self.watchdog_timeout_msg in msg:
-            logger.debug("Server connection timeout detected")
-            threading.Thread(target=self.on_server_not_responding).start()
-        if self.server_response_msg in msg:
-            logger.debug("Server response message caught ({} seconds)".format(
-                time.time() - self.server_response_last_time))
-            self.server_response_last_time = time.time()
-            if self.not_responding_timer:
-                self.stop()
-            self.not_responding_timer = threading.Timer(
-                self.timeout_s, self.on_server_not_responding)
-            self.not_responding_timer.start()
-        if record.levelno >= logger.getEffectiveLevel():
-            super().emit(record)
-
-    def stop(self):
-        if self.not_responding_timer:
-            self.not_responding_timer.cancel()
-            self.not_responding_timer.join()
-            self.not_responding_timer = None
+        if token_response.get("refresh_token"):
+            self.refresh_token = token_response.get("refresh_token")
+        return token_response
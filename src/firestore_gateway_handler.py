@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+
+from device_tunnels_document import DeviceTunnelsDocument
+from firestore_tunnels_handler import FirestoreTunnelsHandler
+from functools import partial
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FirestoreGatewayHandler(FirestoreTunnelsHandler):
+
+    def __init__(self, api_key, project_id, refresh_token, device_ids, tunnels_update_callback=lambda *_: None, backend=None):
+        device_documents = {device_id: DeviceTunnelsDocument(
+            device_id, self._get_device_reference, partial(tunnels_update_callback, device_id))
+            for device_id in device_ids}
+        super().__init__(api_key, project_id, refresh_token, None, backend=backend, device_documents=device_documents)
+        self.device_ids = list(device_ids)
+
+    def update_tunnel_url(self, port, url):
+        raise NotImplementedError("The gateway handles several devices, use update_device_tunnel_url")
+
+    def update_tunnels_status(self, tunnels_status):
+        raise NotImplementedError("The gateway handles several devices, use update_device_tunnels_status")
+
+    def _subscribe(self):
+        logger.debug(f"Listening to the changes of {len(self.device_ids)} devices")
+        return self.client.collection(self.devices_path).on_snapshot(self._on_device_update)
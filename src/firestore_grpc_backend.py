@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+from google.api_core import exceptions
+from google.cloud.firestore import Client
+from google.cloud.firestore_v1 import watch
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _is_token_expiration(exception):
+    return isinstance(watch._maybe_wrap_exception(exception), exceptions.Unauthenticated)
+
+
+# Streams closed because the ID token expired are reopened in place (the new
+# stream picks the refreshed token up and resumes from the last resume token),
+# any other error terminates the watch and is handled by a full restart
+watch._should_recover = _is_token_expiration
+watch._should_terminate = lambda exception: not _is_token_expiration(exception)
+
+
+class FirestoreGrpcBackend:
+
+    def create_client(self, project_id, credentials):
+        return Client(project_id, credentials)
+
+    def attach_liveness(self, subscription, liveness_monitor):
+        consumer = subscription._consumer
+        on_response = consumer._on_response
+
+        def on_response_with_activity(response):
+            liveness_monitor.touch()
+            on_response(response)
+
+        consumer._on_response = on_response_with_activity
+        subscription._rpc.add_done_callback(lambda _: liveness_monitor.expire())
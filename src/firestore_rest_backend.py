@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+from http_transport import get_http_transport
+from runtime import get_runtime
+import base64
+import datetime
+import logging
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+FIRESTORE_API_URL = "https://firestore.googleapis.com/v1"
+SIMPLE_FIELD_NAME = re.compile(r"^[_a-zA-Z][_a-zA-Z0-9]*$")
+
+
+def _decode_value(value):
+    if "mapValue" in value:
+        return _decode_fields(value["mapValue"].get("fields", {}))
+    if "arrayValue" in value:
+        return [_decode_value(item) for item in value["arrayValue"].get("values", [])]
+    if "integerValue" in value:
+        return int(value["integerValue"])
+    if "doubleValue" in value:
+        return float(value["doubleValue"])
+    if "bytesValue" in value:
+        return base64.b64decode(value["bytesValue"])
+    if "geoPointValue" in value:
+        return (value["geoPointValue"].get("latitude", 0.0), value["geoPointValue"].get("longitude", 0.0))
+    if "nullValue" in value:
+        return None
+    for key in ("stringValue", "booleanValue", "timestampValue", "referenceValue"):
+        if key in value:
+            return value[key]
+    logger.warning(f"Unsupported Firestore value {value}")
+    return None
+
+
+def _decode_fields(fields):
+    return {name: _decode_value(value) for name, value in fields.items()}
+
+
+def _encode_value(value):
+    if value is None:
+        return {"nullValue": None}
+    if isinstance(value, bool):
+        return {"booleanValue": value}
+    if isinstance(value, int):
+        return {"integerValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, str):
+        return {"stringValue": value}
+    if isinstance(value, bytes):
+        return {"bytesValue": base64.b64encode(value).decode()}
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return {"timestampValue": f"{value.isoformat()}Z"}
+    if isinstance(value, dict):
+        return {"mapValue": {"fields": _encode_fields(value)}}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_encode_value(item) for item in value]}}
+    raise TypeError(f"Cannot encode value of type '{type(value).__name__}' for Firestore")
+
+
+def _encode_fields(values):
+    return {str(name): _encode_value(value) for name, value in values.items()}
+
+
+def _quote_field_path(field):
+    return ".".join(part if SIMPLE_FIELD_NAME.match(part) else f"`{part}`"
+                    for part in field.split("."))
+
+
+class FirestoreRestBackend:
+
+    POLL_INTERVAL_S = 10
+    # Polls between liveness checks, a single failed poll does not restart the client
+    LIVENESS_POLLS = 3
+
+    def __init__(self, poll_interval_s=POLL_INTERVAL_S):
+        self.poll_interval_s = poll_interval_s
+
+    def create_client(self, project_id, credentials):
+        return FirestoreRestClient(project_id, credentials, self.poll_interval_s)
+
+    def attach_liveness(self, subscription, liveness_monitor):
+        liveness_monitor.timeout_s = max(liveness_monitor.timeout_s, self.LIVENESS_POLLS*self.poll_interval_s)
+        subscription.on_activity = liveness_monitor.touch
+
+
+class FirestoreRestClient:
+
+    PAGE_SIZE = 300
+
+    def __init__(self, project_id, credentials, poll_interval_s=FirestoreRestBackend.POLL_INTERVAL_S):
+        self.credentials = credentials
+        self.poll_interval_s = poll_interval_s
+        self.http_transport = get_http_transport()
+        self.documents_url = f"{FIRESTORE_API_URL}/projects/{project_id}/databases/(default)/documents"
+
+    def collection(self, path):
+        return FirestoreRestCollectionReference(self, path)
+
+    def request(self, method, path, **kwargs):
+        response = self._send_request(method, path, kwargs)
+        if response.status_code == 401:
+            logger.debug("Firestore request unauthorized, refreshing the token id")
+            self.credentials.refresh(None)
+            response = self._send_request(method, path, kwargs)
+        return response
+
+    def _send_request(self, method, path, kwargs):
+        if not self.credentials.valid:
+            self.credentials.refresh(None)
+        headers = {"Authorization": f"Bearer {self.credentials.token}"}
+        return self.http_transport.request(method, f"{self.documents_url}/{path}", headers=headers, **kwargs)
+
+
+class FirestoreRestCollectionReference:
+
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path.strip("/")
+
+    def document(self, document_id):
+        return FirestoreRestDocumentReference(self.client, f"{self.path}/{document_id}")
+
+    def get_documents(self):
+        documents, page_token = [], None
+        while True:
+            params = {"pageSize": self.client.PAGE_SIZE}
+            if page_token:
+                params["pageToken"] = page_token
+            response = self.client.request("GET", self.path, params=params)
+            response.raise_for_status()
+            content = response.json()
+            documents.extend(FirestoreRestDocumentSnapshot.from_document(document)
+                             for document in content.get("documents", []))
+            page_token = content.get("nextPageToken")
+            if not page_token:
+                return documents
+
+    def on_snapshot(self, callback):
+        return FirestoreRestWatch(self.client, self.get_documents, callback)
+
+
+class FirestoreRestDocumentReference:
+
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def get(self):
+        response = self.client.request("GET", self.path)
+        if response.status_code == 404:
+            return FirestoreRestDocumentSnapshot(self.id, None)
+        response.raise_for_status()
+        return FirestoreRestDocumentSnapshot.from_document(response.json())
+
+    def update(self, field_updates):
+        fields = {}
+        for field, value in field_updates.items():
+            *parents, name = field.split(".")
+            nested_fields = fields
+            for parent in parents:
+                nested_fields = nested_fields.setdefault(parent, {})
+            nested_fields[name] = value
+        params = {"updateMask.fieldPaths": [_quote_field_path(field) for field in field_updates],
+                  "currentDocument.exists": "true"}
+        response = self.client.request("PATCH", self.path, params=params, json={"fields": _encode_fields(fields)})
+        response.raise_for_status()
+
+    def on_snapshot(self, callback):
+        def get_documents():
+            snapshot = self.get()
+            return [snapshot] if snapshot.exists else []
+
+        return FirestoreRestWatch(self.client, get_documents, callback)
+
+
+class FirestoreRestDocumentSnapshot:
+
+    def __init__(self, document_id, fields, update_time=None):
+        self.id = document_id
+        self.fields = fields
+        self.update_time = update_time
+        self.exists = fields is not None
+
+    @classmethod
+    def from_document(cls, document):
+        return cls(document["name"].rsplit("/", 1)[-1], _decode_fields(document.get("fields", {})),
+                   document.get("updateTime"))
+
+    def to_dict(self):
+        return self.fields
+
+
+class FirestoreRestDocumentChange:
+
+    def __init__(self, document):
+        self.document = document
+
+
+class FirestoreRestWatch:
+
+    def __init__(self, client, get_documents, callback):
+        self.client = client
+        self.get_documents = get_documents
+        self.callback = callback
+        self.on_activity = lambda: None
+        self.runtime = get_runtime()
+        self.update_times = None
+        self.poll_timer = None
+        self.poll_lock = threading.Lock()
+        self.active = True
+        self.runtime.run_in_executor(self._poll)
+
+    def unsubscribe(self):
+        with self.poll_lock:
+            self.active = False
+            if self.poll_timer:
+                self.poll_timer.cancel()
+                self.poll_timer = None
+
+    def _poll(self):
+        try:
+            documents = self.get_documents()
+        except Exception as e:
+            logger.warning(f"Firestore documents could not be polled: {e}")
+        else:
+            self.on_activity()
+            self._notify_changes(documents)
+        with self.poll_lock:
+            if self.active:
+                self.poll_timer = self.runtime.call_later_in_executor(self.client.poll_interval_s, self._poll)
+
+    def _notify_changes(self, documents):
+        update_times = {document.id: document.update_time for document in documents}
+        if self.update_times is None:
+            changes = [FirestoreRestDocumentChange(document) for document in documents]
+        else:
+            changes = [FirestoreRestDocumentChange(document) for document in documents
+                       if self.update_times.get(document.id) != document.update_time]
+            changes.extend(FirestoreRestDocumentChange(FirestoreRestDocumentSnapshot(document_id, None))
+                           for document_id in set(self.update_times) - set(update_times))
+            if not changes:
+                return
+        self.update_times = update_times
+        if self.active:
+            self.callback(documents, changes, datetime.datetime.now(datetime.timezone.utc))
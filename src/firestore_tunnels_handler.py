@@ -1,25 +1,30 @@
 #!/usr/bin/env python3
 
+from device_tunnels_document import DeviceTunnelsDocument
 from firestore_client_handler import FirestoreClientHandler
+from metrics import METRICS
 import logging
-import threading
 
 logger = logging.getLogger(__name__)
 
+RECONNECTS = METRICS.counter(
+    "iombian_tunnels_firestore_reconnects_total", "Firestore client restart requests", ["reason"])
+SNAPSHOTS = METRICS.counter(
+    "iombian_tunnels_firestore_snapshots_total", "Device snapshots received from Firestore")
 
-class FirestoreTunnelsHandler(FirestoreClientHandler):
 
-    KEYWORD = "tunnels"
-    RESTART_DELAY_TIME_S = 0.5
+class FirestoreTunnelsHandler(FirestoreClientHandler):
 
-    def __init__(self, api_key, project_id, refresh_token, device_id, tunnels_update_callback=lambda _: None):
-        super().__init__(api_key, project_id, refresh_token)
+    def __init__(self, api_key, project_id, refresh_token, device_id, tunnels_update_callback=lambda _: None, backend=None,
+                 device_documents=None):
+        super().__init__(api_key, project_id, refresh_token, backend)
         self.device_id = device_id
         self.users_path = None
         self.devices_path = None
-        self.tunnels_update_callback = tunnels_update_callback
         self.device_subscription = None
-        self.tunnels_cache = None
+        self.user_profile = None
+        self.device_documents = device_documents if device_documents is not None else {device_id: DeviceTunnelsDocument(
+            device_id, self._get_device_reference, tunnels_update_callback)}
 
     def start(self):
         logger.debug("Starting Firestore Tunnels Handler")
@@ -27,14 +32,14 @@ class FirestoreTunnelsHandler(FirestoreClientHandler):
 
     def stop(self):
         logger.debug("Stopping Firestore Tunnels Handler")
-        if self.device_subscription:
-            self.device_subscription.unsubscribe()
-            self.device_subscription = None
+        self.reconnect_scheduler.cancel()
+        self._unsubscribe()
         self.stop_client()
 
     def restart(self):
         logger.debug("Restarting Firestore Tunnels Handler")
-        self.stop()
+        self._unsubscribe()
+        self.stop_client()
         self.start()
 
     def on_client_initialized(self):
@@ -42,16 +47,18 @@ class FirestoreTunnelsHandler(FirestoreClientHandler):
         self.devices_path = f"users/{self.user_id}/devices"
         if self.device_subscription:
             return
-        self.device_subscription = self.client.collection(self.devices_path).document(
-            self.device_id).on_snapshot(self._on_device_update)
+        self.device_subscription = self._subscribe()
+        self.backend.attach_liveness(self.device_subscription, self.liveness_monitor)
 
     def on_server_not_responding(self):
         logger.error("Firestore server not responding")
-        threading.Timer(self.RESTART_DELAY_TIME_S, self.restart).start()
+        RECONNECTS.inc(reason="server_not_responding")
+        self.reconnect_scheduler.request("server_not_responding")
 
     def on_token_expired(self):
-        logger.debug("Refreshing Firebase client token id")
-        threading.Timer(self.RESTART_DELAY_TIME_S, self.restart).start()
+        logger.warning("Firebase client token id expired, restarting the client")
+        RECONNECTS.inc(reason="token_expired")
+        self.reconnect_scheduler.request("token_expired")
 
     def get_tunnel_token(self):
         return self._get_user_field("tunnel_token")
@@ -62,39 +69,60 @@ class FirestoreTunnelsHandler(FirestoreClientHandler):
     def get_user_id(self):
         return self.user_id
 
-    def update_tunnel_url(self, port, url):
-        self.initialize_client(notify=False)
-        if not self.client:
-            logger.debug("Firebase client not ready, cannot update tunnel url")
-            return
-        updated_field = {f"{self.KEYWORD}.{port}.url": url}
-        self.client.collection(self.devices_path).document(
-            self.device_id).update(updated_field)
-
-    def _get_user_field(self, field):
+    def get_user_profile(self):
+        if self.user_profile is not None:
+            return self.user_profile
         self.users_path = f"users"
         self.initialize_client(notify=False)
         if not self.client:
-            logger.error("Firebase client not ready, cannot get user field")
+            logger.error("Firebase client not ready, cannot get user profile")
             return
-        user_info = self.client.collection(self.users_path).document(
+        self.user_profile = self.client.collection(self.users_path).document(
             self.user_id).get().to_dict()
-        return user_info.get(field)
+        return self.user_profile
 
-    def _on_device_update(self, document_snapshot, changes, read_time):
-        if len(document_snapshot) != 1:
-            return
-        device_info = document_snapshot[0].to_dict()
+    def update_tunnel_url(self, port, url):
+        return self.update_device_tunnel_url(self.device_id, port, url)
 
-        if not self.KEYWORD in device_info:
-            logger.warn(
-                f"'{self.KEYWORD}' information not available, creating the new field")
-            updated_field = {f"{self.KEYWORD}": {}}
-            self.client.collection(self.devices_path).document(self.device_id).update(updated_field)
-            return
+    def update_device_tunnel_url(self, device_id, port, url):
+        return self.device_documents[device_id].update_tunnel_url(port, url)
+
+    def update_tunnels_status(self, tunnels_status):
+        self.update_device_tunnels_status(self.device_id, tunnels_status)
+
+    def update_device_tunnels_status(self, device_id, tunnels_status):
+        self.device_documents[device_id].update_tunnels_status(tunnels_status)
+
+    def _subscribe(self):
+        return self.client.collection(self.devices_path).document(
+            self.device_id).on_snapshot(self._on_device_update)
+
+    def _unsubscribe(self):
+        if self.device_subscription:
+            self.device_subscription.unsubscribe()
+            self.device_subscription = None
 
-        tunnels = device_info.get(self.KEYWORD)
+    def _get_device_reference(self, device_id):
+        # The writes wait for the running client, they never create it
+        client = self.client
+        if not client:
+            return None
+        return client.collection(f"users/{self.user_id}/devices").document(device_id)
 
-        if tunnels != self.tunnels_cache:
-            self.tunnels_cache = tunnels
-            self.tunnels_update_callback(tunnels)
\ No newline at end of file
+    def _get_user_field(self, field):
+        user_profile = self.get_user_profile()
+        if not user_profile:
+            return
+        return user_profile.get(field)
+
+    def _on_device_update(self, document_snapshot, changes, read_time):
+        SNAPSHOTS.inc()
+        changed_ids = {change.document.id for change in changes}
+        for document in document_snapshot:
+            device_document = self.device_documents.get(document.id)
+            if not device_document:
+                continue
+            if changed_ids and document.id not in changed_ids:
+                logger.debug(f"Snapshot without changes for device '{document.id}', ignoring it")
+                continue
+            device_document.on_snapshot(document.to_dict())
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import logging
+import requests
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class HttpTransport:
+
+    CONNECT_TIMEOUT_S = 10
+    READ_TIMEOUT_S = 30
+    POOL_CONNECTIONS = 4
+    POOL_MAXSIZE = 8
+    RETRIES = 3
+    RETRY_BACKOFF_FACTOR = 0.5
+    RETRY_STATUS_CODES = (429, 502, 503, 504)
+    RETRY_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+
+    exceptions = requests.exceptions
+
+    def __init__(self, connect_timeout_s=CONNECT_TIMEOUT_S, read_timeout_s=READ_TIMEOUT_S, pool_maxsize=POOL_MAXSIZE, retries=RETRIES):
+        self.timeout = (connect_timeout_s, read_timeout_s)
+        # Connection errors are retried for every method (the request was not
+        # sent), read errors and error statuses only for the idempotent ones
+        retry = Retry(total=retries, connect=retries, read=retries, status=retries,
+                      backoff_factor=self.RETRY_BACKOFF_FACTOR, status_forcelist=self.RETRY_STATUS_CODES,
+                      allowed_methods=self.RETRY_METHODS, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=self.POOL_CONNECTIONS, pool_maxsize=pool_maxsize,
+                              max_retries=retry, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_http_transport():
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = HttpTransport()
+        return _transport
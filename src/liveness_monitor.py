@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+from metrics import METRICS
+from runtime import get_runtime
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+WATCHDOG_TRIPS = METRICS.counter(
+    "iombian_tunnels_watchdog_trips_total", "Server connection timeouts detected by the liveness monitor")
+
+
+class LivenessMonitor:
+
+    def __init__(self, timeout_s=60, on_timeout=lambda: None):
+        self.timeout_s = timeout_s
+        self.on_timeout = on_timeout
+        self.runtime = get_runtime()
+        self.last_activity_time = time.monotonic()
+        self.armed = False
+        self.check_timer = None
+
+    def arm(self):
+        self.last_activity_time = time.monotonic()
+        self.armed = True
+        self.runtime.call_soon(self._schedule_check, self.timeout_s)
+
+    def disarm(self):
+        self.armed = False
+        self.runtime.call_soon(self._cancel_check)
+
+    def stop(self):
+        self.disarm()
+
+    def touch(self):
+        self.last_activity_time = time.monotonic()
+
+    def expire(self):
+        self.last_activity_time = time.monotonic() - self.timeout_s
+        self.runtime.call_soon(self._schedule_check, 0)
+
+    def _schedule_check(self, delay_s):
+        self._cancel_check()
+        if self.armed:
+            self.check_timer = self.runtime.loop.call_later(delay_s, self._check)
+
+    def _cancel_check(self):
+        if self.check_timer:
+            self.check_timer.cancel()
+            self.check_timer = None
+
+    def _check(self):
+        self.check_timer = None
+        if not self.armed:
+            return
+        inactive_s = time.monotonic() - self.last_activity_time
+        if inactive_s < self.timeout_s:
+            self._schedule_check(self.timeout_s - inactive_s)
+            return
+        self.armed = False
+        WATCHDOG_TRIPS.inc()
+        logger.debug(f"Server connection timeout detected ({inactive_s:.1f} seconds without activity)")
+        self.runtime.run_in_executor(self.on_timeout)
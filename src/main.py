@@ -1,26 +1,75 @@
 #!/usr/bin/env python3
 
 import logging
+import os
 import signal
 import sys
+import threading
 
 from communication_module import CommunicationModule
+from firestore_gateway_handler import FirestoreGatewayHandler
 from firestore_tunnels_handler import FirestoreTunnelsHandler
+from functools import partial
+from metrics import METRICS, MetricsServer
+from profiling_hooks import ProfilingHooks
+from reconcile_journal import ReconcileJournal
+from reconcile_worker import ReconcileWorker
+from runtime import get_runtime
+from startup_profiler import StartupProfiler
+from state_backend import get_state_backend
+from state_cache import StateCache
 from tunnel_name_generator import TunnelNameGenerator
 from tunnels_handler import TunnelsHandler
+from tunnels_state_server import TunnelsStateServer
 
 logging.basicConfig(
     format='%(asctime)s %(levelname)-8s - %(name)-16s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 TUNNEL_SERVICE_HOST = "iomtunnels.online"
+GATEWAY_DEVICE_IDS = [device_id.strip() for device_id in os.environ.get("GATEWAY_DEVICE_IDS", "").split(",")
+                      if device_id.strip()]
+PROVISIONING_MAX_WORKERS = int(os.environ.get("PROVISIONING_MAX_WORKERS", 4))
+# Every device reconcile holds a runtime executor worker while it waits for
+# its provisioning operations (all of them run at once after the first
+# gateway snapshot), at least one more is needed for the timers
+MIN_RUNTIME_EXECUTOR_WORKERS = max(1, len(GATEWAY_DEVICE_IDS)) + 1
+RUNTIME_EXECUTOR_WORKERS = int(os.environ.get("RUNTIME_EXECUTOR_WORKERS", MIN_RUNTIME_EXECUTOR_WORKERS + 2))
+RECONCILE_DEBOUNCE_TIME_S = float(os.environ.get("RECONCILE_DEBOUNCE_TIME_S", 0.5))
+STATE_FILE_PATH = os.environ.get("STATE_FILE_PATH", "state.json")
+JOURNAL_FILE_PATH = os.environ.get("JOURNAL_FILE_PATH", "journal.jsonl")
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9464))
+HEALTH_PROBE_MIN_INTERVAL_S = float(os.environ.get("HEALTH_PROBE_MIN_INTERVAL_S", 5))
+HEALTH_PROBE_MAX_INTERVAL_S = float(os.environ.get("HEALTH_PROBE_MAX_INTERVAL_S", 60))
+HEALTH_PROBE_PUBLIC = os.environ.get("HEALTH_PROBE_PUBLIC", "1") == "1"
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "grpc")
+STATE_POLL_INTERVAL_S = float(os.environ.get("STATE_POLL_INTERVAL_S", 10))
+PROFILING_DIR = os.environ.get("PROFILING_DIR", "profiles")
+PROFILING_MODE = os.environ.get("PROFILING_MODE", ProfilingHooks.SAMPLING)
+PROFILING_WINDOW_S = float(os.environ.get("PROFILING_WINDOW_S", 30))
+LOCAL_API_QUERY_ENDPOINT = os.environ.get("LOCAL_API_QUERY_ENDPOINT", TunnelsStateServer.QUERY_ENDPOINT)
+LOCAL_API_PUBLISH_ENDPOINT = os.environ.get("LOCAL_API_PUBLISH_ENDPOINT", TunnelsStateServer.PUBLISH_ENDPOINT)
+CONFIG_COMMANDS = ["get_api_key", "get_project_id",
+                   "get_refresh_token", "get_device_id"]
 
 
 def stop():
+    # A second signal while stopping must not stop everything again
+    if stop_event.is_set():
+        return
+    stop_event.set()
     logger.info("Stopping IoMBian Tunnels Service")
+    if reconcile_worker: reconcile_worker.stop()
+    for device_reconcile_worker in device_reconcile_workers.values(): device_reconcile_worker.stop()
     if tunnels_handler: tunnels_handler.stop()
+    for device_tunnels_handler in device_tunnels_handlers.values(): device_tunnels_handler.stop()
     if firestore_tunnels_handler: firestore_tunnels_handler.stop()
+    if reconcile_journal: reconcile_journal.close()
     if comm_module: comm_module.stop()
+    if metrics_server: metrics_server.stop()
+    if tunnels_state_server: tunnels_state_server.stop()
+    runtime.stop()
 
 
 def signal_handler(sig, frame):
@@ -28,53 +77,215 @@ def signal_handler(sig, frame):
 
 
 def on_tunnels_state_update(tunnels):
+    startup_profiler.mark("first_snapshot")
+    reconcile_worker.submit(tunnels)
+
+
+def reconcile_tunnels(tunnels):
     tunnels_handler.on_tunnels_update(tunnels)
+    startup_profiler.mark("first_reconcile")
+    state_cache.update(tunnels=tunnels, active_tunnels=tunnels_handler.get_state())
+    if tunnels_state_server:
+        tunnels_state_server.update_device(tunnels_handler.device_name, tunnels, tunnels_handler.active_tunnels)
+
+
+def reconcile_device_tunnels(device_id, tunnels):
+    device_tunnels_handler = device_tunnels_handlers[device_id]
+    device_tunnels_handler.on_tunnels_update(tunnels)
+    if tunnels_state_server:
+        tunnels_state_server.update_device(device_id, tunnels, device_tunnels_handler.active_tunnels)
+
+
+def on_device_tunnels_state_update(device_id, tunnels):
+    startup_profiler.mark("first_snapshot")
+    device_reconcile_workers[device_id].submit(tunnels)
+
+
+def create_tunnels_handler(tunnel_token, user_email, user_id, device_id, gateway=False):
+    tunnel_name_generator = TunnelNameGenerator(user_id, device_id)
+    health_prober_options = {"min_interval_s": HEALTH_PROBE_MIN_INTERVAL_S, "max_interval_s": HEALTH_PROBE_MAX_INTERVAL_S,
+                             "probe_public": HEALTH_PROBE_PUBLIC}
+    handler = TunnelsHandler(
+        TUNNEL_SERVICE_HOST, tunnel_token, user_email, device_id, tunnel_name_generator, PROVISIONING_MAX_WORKERS,
+        health_prober_options=health_prober_options, journal=reconcile_journal)
+    if gateway:
+        handler.add_tunnel_available_callback(partial(on_tunnel_available, device_id=device_id))
+        handler.add_tunnel_status_callback(partial(on_tunnels_status, device_id=device_id))
+    else:
+        handler.add_tunnel_available_callback(on_tunnel_available)
+        handler.add_tunnel_status_callback(on_tunnels_status)
+    return handler
 
 
-def on_tunnel_available(tunnel_info):
+def get_user_state(state):
+    return {key: state.get(key) for key in ("tunnel_token", "user_email", "user_id", "device_id")}
+
+
+def on_tunnel_available(tunnel_info, device_id=None):
     logger.info(f"New tunnel available: {tunnel_info}")
+    startup_profiler.mark("first_tunnel_available")
     port = tunnel_info.get("port")
     url = tunnel_info.get("url")
     if not port or not url:
         logger.error(f"New available tunnel is not correct: {tunnel_info}")
         return
-    firestore_tunnels_handler.update_tunnel_url(port, url)
+    if tunnels_state_server:
+        tunnels_state_server.update_tunnel_url(device_id or tunnels_handler.device_name, port, url)
+    if not firestore_tunnels_handler:
+        logger.debug("Firestore not started yet, the tunnel will be published after the first snapshot")
+        return
+    if device_id:
+        return firestore_tunnels_handler.update_device_tunnel_url(device_id, port, url)
+    return firestore_tunnels_handler.update_tunnel_url(port, url)
 
 
-if __name__ == "__main__":
-    logger.info("Starting IoMBian Tunnels Service")
+def on_tunnels_status(tunnels_status, device_id=None):
+    logger.debug(f"Tunnels status: {tunnels_status}")
+    if tunnels_state_server:
+        tunnels_state_server.update_tunnels_status(device_id or tunnels_handler.device_name, tunnels_status)
+    if not firestore_tunnels_handler:
+        return
+    if device_id:
+        firestore_tunnels_handler.update_device_tunnels_status(device_id, tunnels_status)
+    else:
+        firestore_tunnels_handler.update_tunnels_status(tunnels_status)
 
-    comm_module, tunnels_handler, firestore_tunnels_handler = None, None, None
 
-    comm_module = CommunicationModule(host="127.0.0.1", port=5555)
-    comm_module.start()
+def start_device(api_key, project_id, refresh_token, device_id):
+    global firestore_tunnels_handler, tunnels_handler
+    firestore_tunnels_handler = FirestoreTunnelsHandler(
+        api_key, project_id, refresh_token, device_id, on_tunnels_state_update, state_backend)
 
-    api_key = comm_module.execute_command("get_api_key")
-    project_id = comm_module.execute_command("get_project_id")
-    refresh_token = comm_module.execute_command(
-        "get_refresh_token")
-    device_id = comm_module.execute_command("get_device_id")
+    with startup_profiler.phase("user_profile"):
+        tunnel_token = firestore_tunnels_handler.get_tunnel_token()
+        user_email = firestore_tunnels_handler.get_user_email()
+        user_id = firestore_tunnels_handler.get_user_id()
+    user_state = {"tunnel_token": tunnel_token, "user_email": user_email,
+                  "user_id": user_id, "device_id": device_id}
+
+    if not tunnel_token and tunnels_handler and cached_user_state["device_id"] == device_id:
+        logger.warning(
+            "User information not available, using the cached state until Firestore is reachable")
+    elif not tunnel_token:
+        logger.error("This user does not have a valid tunnel token")
+        stop()
+        sys.exit(1)
+    elif user_state != cached_user_state:
+        if tunnels_handler:
+            logger.info("Cached user information is outdated, restarting the tunnels")
+            tunnels_handler.stop()
+        tunnels_handler = create_tunnels_handler(**user_state)
+        state_cache.update(tunnels=None, active_tunnels={}, **user_state)
+
+    with startup_profiler.phase("tunnels_and_subscription"):
+        startup_tasks = [
+            runtime.run_in_executor(startup_profiler.timed(
+                "firestore_subscription", firestore_tunnels_handler.start)),
+            runtime.run_in_executor(startup_profiler.timed(
+                "tunnels_handler_start", tunnels_handler.start))]
+        for startup_task in startup_tasks:
+            startup_task.result()
+    reconcile_worker.start()
 
-    firestore_tunnels_handler = FirestoreTunnelsHandler(
-        api_key, project_id, refresh_token, device_id, on_tunnels_state_update)
 
-    tunnel_token = firestore_tunnels_handler.get_tunnel_token()
-    user_email = firestore_tunnels_handler.get_user_email()
-    user_id = firestore_tunnels_handler.get_user_id()
+def start_gateway(api_key, project_id, refresh_token):
+    global firestore_tunnels_handler
+    logger.info(f"Starting in gateway mode for {len(GATEWAY_DEVICE_IDS)} devices")
+    firestore_tunnels_handler = FirestoreGatewayHandler(
+        api_key, project_id, refresh_token, GATEWAY_DEVICE_IDS, on_device_tunnels_state_update, state_backend)
+
+    with startup_profiler.phase("user_profile"):
+        tunnel_token = firestore_tunnels_handler.get_tunnel_token()
+        user_email = firestore_tunnels_handler.get_user_email()
+        user_id = firestore_tunnels_handler.get_user_id()
     if not tunnel_token:
         logger.error("This user does not have a valid tunnel token")
         stop()
         sys.exit(1)
 
-    tunnel_name_generator = TunnelNameGenerator(user_id, device_id)
+    for device_id in GATEWAY_DEVICE_IDS:
+        device_tunnels_handlers[device_id] = create_tunnels_handler(
+            tunnel_token, user_email, user_id, device_id, gateway=True)
+        device_reconcile_workers[device_id] = ReconcileWorker(
+            partial(reconcile_device_tunnels, device_id), RECONCILE_DEBOUNCE_TIME_S)
+
+    with startup_profiler.phase("tunnels_and_subscription"):
+        startup_tasks = [runtime.run_in_executor(firestore_tunnels_handler.start)] + \
+            [runtime.run_in_executor(handler.start) for handler in device_tunnels_handlers.values()]
+        for startup_task in startup_tasks:
+            startup_task.result()
+    for device_reconcile_worker in device_reconcile_workers.values():
+        device_reconcile_worker.start()
+
+
+if __name__ == "__main__":
+    logger.info("Starting IoMBian Tunnels Service")
+
+    if RUNTIME_EXECUTOR_WORKERS < MIN_RUNTIME_EXECUTOR_WORKERS:
+        logger.error(
+            f"RUNTIME_EXECUTOR_WORKERS must be at least {MIN_RUNTIME_EXECUTOR_WORKERS} (one per device reconcile plus one)")
+        sys.exit(1)
+
+    startup_profiler = StartupProfiler()
+    runtime = get_runtime(RUNTIME_EXECUTOR_WORKERS)
+    comm_module, tunnels_handler, firestore_tunnels_handler, reconcile_worker = None, None, None, None
+    reconcile_journal = None
+    device_tunnels_handlers, device_reconcile_workers = {}, {}
+    stop_event = threading.Event()
+
+    if PROFILING_DIR:
+        profiling_hooks = ProfilingHooks(PROFILING_DIR, PROFILING_WINDOW_S, PROFILING_MODE)
+        profiling_hooks.install()
+
+    metrics_server = None
+    if METRICS_PORT:
+        metrics_server = MetricsServer(METRICS, METRICS_HOST, METRICS_PORT)
+        metrics_server.start()
+
+    tunnels_state_server = None
+    if LOCAL_API_QUERY_ENDPOINT and LOCAL_API_PUBLISH_ENDPOINT:
+        tunnels_state_server = TunnelsStateServer(LOCAL_API_QUERY_ENDPOINT, LOCAL_API_PUBLISH_ENDPOINT)
+        tunnels_state_server.start()
+
+    with startup_profiler.phase("state_cache"):
+        state_cache = StateCache(STATE_FILE_PATH)
+        cached_state = state_cache.load()
+        cached_user_state = get_user_state(cached_state)
+        reconcile_journal = ReconcileJournal(JOURNAL_FILE_PATH)
+        reconcile_journal.load()
+
+    reconcile_worker = ReconcileWorker(
+        reconcile_tunnels, RECONCILE_DEBOUNCE_TIME_S)
+
+    if all(cached_user_state.values()) and not GATEWAY_DEVICE_IDS:
+        logger.info("Warm starting the tunnels from the cached state")
+        with startup_profiler.phase("warm_start"):
+            tunnels_handler = create_tunnels_handler(**cached_user_state)
+            tunnels_handler.load_state(cached_state.get("active_tunnels", {}))
+            tunnels_handler.start()
+            reconcile_worker.start()
+            if cached_state.get("tunnels") is not None:
+                reconcile_worker.submit(cached_state.get("tunnels"))
+
+    with startup_profiler.phase("config"):
+        comm_module = CommunicationModule(host="127.0.0.1", port=5555)
+        comm_module.start()
+        config = comm_module.execute_commands(CONFIG_COMMANDS)
+        while None in config:
+            logger.warning("Configuration not available yet, retrying...")
+            config = comm_module.execute_commands(CONFIG_COMMANDS)
+        api_key, project_id, refresh_token, device_id = config
 
-    tunnels_handler = TunnelsHandler(
-        TUNNEL_SERVICE_HOST, tunnel_token, user_email, device_id, tunnel_name_generator)
-    tunnels_handler.add_tunnel_available_callback(on_tunnel_available)
-    tunnels_handler.start()
+    with startup_profiler.phase("state_backend"):
+        state_backend = get_state_backend(STATE_BACKEND, STATE_POLL_INTERVAL_S)
 
-    firestore_tunnels_handler.start()
+    if GATEWAY_DEVICE_IDS:
+        start_gateway(api_key, project_id, refresh_token)
+    else:
+        start_device(api_key, project_id, refresh_token, device_id)
+    startup_profiler.mark("startup_completed")
 
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
-    signal.pause()
+    # Profiling signals interrupt the wait too, keep waiting until stopped
+    stop_event.wait()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+from contextlib import contextmanager
+from runtime import get_runtime
+import asyncio
+import bisect
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _escape_label_value(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, labelvalues, extra_labels=()):
+    labels = list(zip(labelnames, labelvalues)) + list(extra_labels)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {} if self.labelnames else {(): 0}
+        self.lock = threading.Lock()
+
+    def _get_key(self, labels):
+        return tuple(str(labels.get(labelname, "")) for labelname in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.TYPE}"]
+        lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self):
+        with self.lock:
+            values = dict(self.values)
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in values.items()]
+
+
+class Counter(Metric):
+
+    TYPE = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+
+    TYPE = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.value_function = None
+
+    def set(self, value, **labels):
+        key = self._get_key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set_function(self, value_function):
+        self.value_function = value_function
+
+    def _render_samples(self):
+        if self.value_function:
+            try:
+                return [f"{self.name} {_format_value(self.value_function())}"]
+            except Exception as e:
+                logger.debug(f"Value of '{self.name}' could not be computed: {e}")
+                return []
+        return super()._render_samples()
+
+
+class Histogram(Metric):
+
+    TYPE = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                       0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.values = {} if self.labelnames else {(): ([0] * len(self.buckets), 0)}
+
+    def observe(self, value, **labels):
+        key = self._get_key(labels)
+        bucket_index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            bucket_counts, total = self.values.get(
+                key, ([0] * len(self.buckets), 0))
+            bucket_counts[bucket_index] += 1
+            self.values[key] = (bucket_counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start_time, **labels)
+
+    def _render_samples(self):
+        with self.lock:
+            values = {key: (list(bucket_counts), total)
+                      for key, (bucket_counts, total) in self.values.items()}
+        lines = []
+        for key, (bucket_counts, total) in values.items():
+            cumulative_count = 0
+            for upper_bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative_count += bucket_count
+                labels = _format_labels(
+                    self.labelnames, key, [("le", _format_value(upper_bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative_count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative_count}")
+        return lines
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric_class, name, documentation, labelnames, **kwargs):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = metric_class(
+                    name, documentation, labelnames, **kwargs)
+            return self.metrics[name]
+
+
+class MetricsServer:
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+    REQUEST_TIMEOUT_S = 5
+
+    def __init__(self, registry, host="127.0.0.1", port=9464):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.runtime = get_runtime()
+        self.server = None
+
+    def start(self):
+        logger.debug(f"Starting metrics server ('{self.host}:{self.port}')")
+        try:
+            self.server = self.runtime.run_coroutine(asyncio.start_server(
+                self._handle_connection, self.host, self.port)).result()
+        except OSError as e:
+            logger.error(f"Metrics server could not be started: {e}")
+
+    def stop(self):
+        logger.debug("Stopping metrics server")
+        if self.server:
+            self.runtime.call_soon(self.server.close)
+            self.server = None
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), self.REQUEST_TIMEOUT_S)
+            while (await asyncio.wait_for(reader.readline(), self.REQUEST_TIMEOUT_S)).strip():
+                pass
+            request_parts = request_line.decode("latin-1").split()
+            path = request_parts[1].split("?")[0] if len(request_parts) > 1 else ""
+            if path == "/metrics":
+                status, body = "200 OK", self.registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+            writer.write((f"HTTP/1.1 {status}\r\nContent-Type: {self.CONTENT_TYPE}\r\n"
+                          f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            logger.debug(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
+
+
+METRICS = MetricsRegistry()
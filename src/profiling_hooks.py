@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+from collections import Counter
+from runtime import get_runtime
+import cProfile
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilingHooks:
+
+    SAMPLING = "sampling"
+    CPROFILE = "cprofile"
+
+    WINDOW_S = 30
+    SAMPLE_INTERVAL_S = 0.01
+    TRACEMALLOC_FRAMES = 10
+    TOP_STATS = 50
+
+    def __init__(self, output_dir, window_s=WINDOW_S, mode=SAMPLING, sample_interval_s=SAMPLE_INTERVAL_S):
+        if mode not in (self.SAMPLING, self.CPROFILE):
+            raise ValueError(f"Unknown profiling mode '{mode}'")
+        self.output_dir = output_dir
+        self.window_s = window_s
+        self.mode = mode
+        self.sample_interval_s = sample_interval_s
+        self.runtime = get_runtime()
+        self.profiling_thread = None
+        self.memory_lock = threading.Lock()
+        self.memory_snapshot = None
+
+    def install(self):
+        logger.debug(f"Profiling hooks installed, output written to '{self.output_dir}'")
+        signal.signal(signal.SIGUSR1, lambda *_: self.start_profile())
+        signal.signal(signal.SIGUSR2, lambda *_: self.dump_memory_and_threads())
+
+    def start_profile(self):
+        if self.profiling_thread and self.profiling_thread.is_alive():
+            logger.warning("A profiling window is already running, ignoring the request")
+            return
+        target = self._run_sampling_profile if self.mode == self.SAMPLING else self._run_cprofile
+        self.profiling_thread = threading.Thread(target=target, name="profiler", daemon=True)
+        self.profiling_thread.start()
+
+    def dump_memory_and_threads(self):
+        threading.Thread(target=self._dump_memory_and_threads, name="memory-profiler", daemon=True).start()
+
+    def _run_sampling_profile(self):
+        logger.info(f"Sampling all the threads for {self.window_s} seconds")
+        thread_names = {}
+        stacks = Counter()
+        end_time = time.monotonic() + self.window_s
+        while time.monotonic() < end_time:
+            for thread in threading.enumerate():
+                thread_names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == threading.get_ident():
+                    continue
+                stacks[self._collapse_stack(thread_names.get(thread_id, thread_id), frame)] += 1
+            time.sleep(self.sample_interval_s)
+        path = self._get_output_path("profile", "collapsed")
+        with open(path, "w") as profile_file:
+            for stack, count in stacks.most_common():
+                profile_file.write(f"{stack} {count}\n")
+        logger.info(f"Sampling profile written to '{path}' ({sum(stacks.values())} samples)")
+
+    def _run_cprofile(self):
+        # cProfile hooks a single thread, the runtime loop (timers, probes and
+        # the metrics server) is the one that is profiled
+        logger.info(f"Profiling the runtime loop for {self.window_s} seconds")
+        profile = cProfile.Profile()
+        self.runtime.run_sync(profile.enable)
+        time.sleep(self.window_s)
+        self.runtime.run_sync(profile.disable)
+        path = self._get_output_path("profile", "pstats")
+        profile.dump_stats(path)
+        logger.info(f"cProfile stats written to '{path}'")
+
+    def _dump_memory_and_threads(self):
+        path = self._get_output_path("threads", "txt")
+        with open(path, "w") as threads_file:
+            threads_file.write(self._format_thread_stacks())
+        logger.info(f"Thread stacks written to '{path}'")
+
+        with self.memory_lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.TRACEMALLOC_FRAMES)
+                logger.info("Memory allocation tracing started, send the signal again to take a snapshot")
+                return
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                (tracemalloc.Filter(False, tracemalloc.__file__),))
+            previous_snapshot, self.memory_snapshot = self.memory_snapshot, snapshot
+
+        path = self._get_output_path("memory", "txt")
+        with open(path, "w") as memory_file:
+            current_size, peak_size = tracemalloc.get_traced_memory()
+            memory_file.write(f"Traced memory: {current_size/1024:.1f} KiB (peak {peak_size/1024:.1f} KiB)\n\n")
+            memory_file.write(f"Top {self.TOP_STATS} allocation sites:\n")
+            for stat in snapshot.statistics("lineno")[:self.TOP_STATS]:
+                memory_file.write(f"{stat}\n")
+            if previous_snapshot:
+                memory_file.write(f"\nTop {self.TOP_STATS} differences with the previous snapshot:\n")
+                for stat in snapshot.compare_to(previous_snapshot, "lineno")[:self.TOP_STATS]:
+                    memory_file.write(f"{stat}\n")
+        logger.info(f"Memory snapshot written to '{path}'")
+
+    def _format_thread_stacks(self):
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        lines = []
+        for thread_id, frame in sys._current_frames().items():
+            lines.append(f"Thread '{thread_names.get(thread_id, thread_id)}' ({thread_id}):\n")
+            lines.extend(traceback.format_stack(frame))
+            lines.append("\n")
+        return "".join(lines)
+
+    def _collapse_stack(self, thread_name, frame):
+        functions = []
+        while frame:
+            code = frame.f_code
+            functions.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join([str(thread_name)] + functions[::-1])
+
+    def _get_output_path(self, kind, extension):
+        os.makedirs(self.output_dir, exist_ok=True)
+        return os.path.join(self.output_dir, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.{extension}")
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+from runtime import get_runtime
+import json
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ReconcileJournal:
+
+    CREATE = "create"
+    DELETE = "delete"
+    PUBLISH = "publish"
+
+    FSYNC_INTERVAL_S = 1
+    COMPACT_INTERVAL_S = 600
+
+    def __init__(self, file_path, fsync_interval_s=FSYNC_INTERVAL_S, compact_interval_s=COMPACT_INTERVAL_S):
+        self.file_path = file_path
+        self.fsync_interval_s = fsync_interval_s
+        self.compact_interval_s = compact_interval_s
+        self.runtime = get_runtime()
+        self.pending_entries = {}
+        self.next_entry_id = 1
+        self.completed_count = 0
+        self.journal_file = None
+        self.fsync_timer = None
+        self.compact_timer = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        entries = {}
+        try:
+            with open(self.file_path) as journal_file:
+                for line in journal_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Only the last record can be partially written by a crash
+                        logger.warning(f"Ignoring corrupted record of journal '{self.file_path}'")
+                        continue
+                    if record.get("done"):
+                        entries.pop(record.get("id"), None)
+                    else:
+                        entries[record.get("id")] = record
+        except FileNotFoundError:
+            logger.debug(f"Journal file '{self.file_path}' not found")
+        except OSError as e:
+            logger.warning(f"Journal file '{self.file_path}' could not be read: {e}")
+        with self.lock:
+            self.pending_entries = entries
+            self.next_entry_id = max(entries, default=0) + 1
+            self._compact()
+        if entries:
+            logger.info(f"Journal '{self.file_path}' has {len(entries)} incomplete operations")
+        self._schedule_compaction()
+
+    def begin(self, operation, device, port, **data):
+        with self.lock:
+            entry_id = self.next_entry_id
+            self.next_entry_id += 1
+            record = {"id": entry_id, "op": operation, "device": device, "port": port, **data}
+            self.pending_entries[entry_id] = record
+            self._append(record)
+        return entry_id
+
+    def complete(self, entry_id):
+        with self.lock:
+            if self.pending_entries.pop(entry_id, None) is None:
+                return
+            self.completed_count += 1
+            self._append({"id": entry_id, "done": True})
+
+    def get_pending(self, device):
+        with self.lock:
+            return [dict(record) for entry_id, record in sorted(self.pending_entries.items())
+                    if record["device"] == device]
+
+    def compact(self):
+        with self.lock:
+            self._compact()
+
+    def close(self):
+        with self.lock:
+            for timer in (self.fsync_timer, self.compact_timer):
+                if timer:
+                    timer.cancel()
+            self.fsync_timer, self.compact_timer = None, None
+            if self.journal_file:
+                self._fsync()
+                self.journal_file.close()
+                self.journal_file = None
+
+    def _append(self, record):
+        if not self.journal_file:
+            return
+        try:
+            self.journal_file.write(json.dumps(record) + "\n")
+            self.journal_file.flush()
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Journal record could not be written: {e}")
+            return
+        if not self.fsync_timer:
+            self.fsync_timer = self.runtime.call_later_in_executor(self.fsync_interval_s, self._on_fsync_timer)
+
+    def _on_fsync_timer(self):
+        with self.lock:
+            self.fsync_timer = None
+            if self.journal_file:
+                self._fsync()
+
+    def _fsync(self):
+        try:
+            os.fsync(self.journal_file.fileno())
+        except OSError as e:
+            logger.error(f"Journal file '{self.file_path}' could not be synced: {e}")
+
+    def _compact(self):
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".journal-", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as temp_file:
+                    for _, record in sorted(self.pending_entries.items()):
+                        temp_file.write(json.dumps(record) + "\n")
+                    temp_file.flush()
+                    os.fsync(temp_file.fileno())
+                os.replace(temp_path, self.file_path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+            directory_fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(directory_fd)
+            finally:
+                os.close(directory_fd)
+            journal_file = open(self.file_path, "a")
+        except OSError as e:
+            logger.error(f"Journal file '{self.file_path}' could not be compacted: {e}")
+            return
+        # The pending records are already synced in the new file
+        if self.journal_file:
+            self.journal_file.close()
+        self.journal_file = journal_file
+        logger.debug(f"Journal compacted, {self.completed_count} completed operations removed")
+        self.completed_count = 0
+
+    def _schedule_compaction(self):
+        self.compact_timer = self.runtime.call_later_in_executor(self.compact_interval_s, self._on_compact_timer)
+
+    def _on_compact_timer(self):
+        with self.lock:
+            if not self.journal_file:
+                return
+            if self.completed_count:
+                self._compact()
+            self._schedule_compaction()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+from metrics import METRICS
+from runtime import get_runtime
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_TO_RECONCILE_LATENCY = METRICS.histogram(
+    "iombian_tunnels_snapshot_to_reconcile_seconds", "Time from a tunnels update until it has been reconciled")
+
+
+class ReconcileWorker:
+
+    DEBOUNCE_TIME_S = 0.5
+    MAX_DELAY_TIME_S = 5
+
+    def __init__(self, reconcile_callback, debounce_time_s=DEBOUNCE_TIME_S, max_delay_time_s=MAX_DELAY_TIME_S):
+        self.reconcile_callback = reconcile_callback
+        self.debounce_time_s = debounce_time_s
+        self.max_delay_time_s = max_delay_time_s
+        self.runtime = get_runtime()
+        self.lock = threading.Lock()
+        self.pending_state = None
+        self.pending_count = 0
+        self.first_submit_time = None
+        self.last_submit_time = None
+        self.running = False
+        self.reconcile_future = None
+        self.debounce_timer = None
+
+    def start(self):
+        logger.debug("Starting reconcile worker")
+        self.running = True
+        self.runtime.call_soon(self._schedule_reconcile)
+
+    def stop(self):
+        logger.debug("Stopping reconcile worker")
+        self.running = False
+        self.runtime.call_soon(self._cancel_debounce_timer)
+        reconcile_future = self.reconcile_future
+        if reconcile_future and not self.runtime.is_loop_thread():
+            try:
+                reconcile_future.result()
+            except Exception:
+                pass
+
+    def submit(self, state):
+        with self.lock:
+            now = time.monotonic()
+            if not self.pending_count:
+                self.first_submit_time = now
+            self.pending_state = state
+            self.pending_count += 1
+            self.last_submit_time = now
+        self.runtime.call_soon(self._schedule_reconcile)
+
+    def _get_remaining_delay(self):
+        now = time.monotonic()
+        debounce_deadline = self.last_submit_time + self.debounce_time_s
+        max_deadline = self.first_submit_time + self.max_delay_time_s
+        return min(debounce_deadline, max_deadline) - now
+
+    def _cancel_debounce_timer(self):
+        if self.debounce_timer:
+            self.debounce_timer.cancel()
+            self.debounce_timer = None
+
+    def _schedule_reconcile(self):
+        self._cancel_debounce_timer()
+        if not self.running or self.reconcile_future:
+            return
+        with self.lock:
+            if not self.pending_count:
+                return
+            remaining_delay = self._get_remaining_delay()
+            if remaining_delay > 0:
+                self.debounce_timer = self.runtime.loop.call_later(
+                    remaining_delay, self._schedule_reconcile)
+                return
+            state, coalesced_count = self.pending_state, self.pending_count
+            first_submit_time = self.first_submit_time
+            self.pending_state, self.pending_count = None, 0
+        self.reconcile_future = self.runtime.run_in_executor(
+            self._reconcile, state, coalesced_count, first_submit_time)
+        self.reconcile_future.add_done_callback(
+            lambda _: self.runtime.call_soon(self._on_reconcile_done))
+
+    def _on_reconcile_done(self):
+        self.reconcile_future = None
+        self._schedule_reconcile()
+
+    def _reconcile(self, state, coalesced_count, first_submit_time):
+        if coalesced_count > 1:
+            logger.debug(
+                f"{coalesced_count} state updates coalesced into one reconcile")
+        try:
+            self.reconcile_callback(state)
+        except Exception as e:
+            logger.error(f"Reconcile failed: {e}")
+        SNAPSHOT_TO_RECONCILE_LATENCY.observe(time.monotonic() - first_submit_time)
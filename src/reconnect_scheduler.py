@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+from metrics import METRICS
+from runtime import get_runtime
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_REQUESTS = METRICS.counter(
+    "iombian_tunnels_reconnect_requests_total", "Reconnect requests, merged ones included", ["merged"])
+RECONNECT_ATTEMPTS = METRICS.gauge(
+    "iombian_tunnels_reconnect_attempts", "Reconnects since the connection was last stable")
+RECONNECT_DELAY = METRICS.gauge(
+    "iombian_tunnels_reconnect_delay_seconds", "Delay of the last scheduled reconnect")
+
+
+class ReconnectScheduler:
+
+    MIN_DELAY_S = 0.5
+    MAX_DELAY_S = 300
+    MULTIPLIER = 2
+    STABLE_TIME_S = 300
+
+    def __init__(self, reconnect_callback, min_delay_s=MIN_DELAY_S, max_delay_s=MAX_DELAY_S, multiplier=MULTIPLIER,
+                 stable_time_s=STABLE_TIME_S):
+        self.reconnect_callback = reconnect_callback
+        self.min_delay_s = min_delay_s
+        self.max_delay_s = max(min_delay_s, max_delay_s)
+        self.multiplier = multiplier
+        self.stable_time_s = stable_time_s
+        self.runtime = get_runtime()
+        self.attempts = 0
+        self.reasons = []
+        self.reconnect_timer = None
+        self.reconnect_time = None
+        self.last_delay_s = None
+        self.connected_time = None
+        self.lock = threading.Lock()
+
+    def request(self, reason):
+        with self.lock:
+            if self.reconnect_timer:
+                logger.debug(f"Reconnect already scheduled, merging '{reason}' request")
+                self.reasons.append(reason)
+                RECONNECT_REQUESTS.inc(merged="true")
+                return False
+            now = time.monotonic()
+            if self.connected_time is not None and now - self.connected_time >= self.stable_time_s:
+                self.attempts = 0
+            self.connected_time = None
+            backoff_s = min(self.max_delay_s, self.min_delay_s * self.multiplier**self.attempts)
+            # Full jitter spreads the reconnects of a whole fleet after an outage
+            delay_s = random.uniform(self.min_delay_s, backoff_s)
+            self.attempts += 1
+            self.reasons = [reason]
+            self.last_delay_s = delay_s
+            self.reconnect_time = now + delay_s
+            self.reconnect_timer = self.runtime.call_later_in_executor(delay_s, self._reconnect)
+            RECONNECT_REQUESTS.inc(merged="false")
+            RECONNECT_ATTEMPTS.set(self.attempts)
+            RECONNECT_DELAY.set(delay_s)
+        logger.info(f"Reconnecting in {delay_s:.1f} seconds ({reason}, attempt {self.attempts})")
+        return True
+
+    def is_scheduled(self):
+        with self.lock:
+            return self.reconnect_timer is not None
+
+    def mark_connected(self):
+        with self.lock:
+            self.connected_time = time.monotonic()
+
+    def cancel(self):
+        with self.lock:
+            if self.reconnect_timer:
+                self.reconnect_timer.cancel()
+                self.reconnect_timer = None
+            self.reasons = []
+            self.reconnect_time = None
+
+    def get_state(self):
+        with self.lock:
+            now = time.monotonic()
+            return {"scheduled": self.reconnect_timer is not None,
+                    "reasons": list(self.reasons),
+                    "attempts": self.attempts,
+                    "next_reconnect_in_s": max(0, self.reconnect_time - now) if self.reconnect_time else None,
+                    "last_delay_s": self.last_delay_s,
+                    "connected_for_s": now - self.connected_time if self.connected_time is not None else None}
+
+    def _reconnect(self):
+        with self.lock:
+            if not self.reconnect_timer:
+                return
+            reasons = self.reasons
+            self.reconnect_timer = None
+            self.reasons = []
+            self.reconnect_time = None
+        logger.debug(f"Reconnecting after {len(reasons)} requests ({', '.join(reasons)})")
+        self.reconnect_callback()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+from concurrent import futures
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Runtime:
+
+    EXECUTOR_MAX_WORKERS = 6
+
+    def __init__(self, executor_max_workers=EXECUTOR_MAX_WORKERS):
+        self.loop = asyncio.new_event_loop()
+        self.executor = futures.ThreadPoolExecutor(
+            max_workers=executor_max_workers, thread_name_prefix="runtime-executor")
+        self.loop.set_default_executor(self.executor)
+        self.thread = None
+
+    def start(self):
+        if self.thread:
+            return
+        logger.debug("Starting runtime event loop")
+        self.thread = threading.Thread(
+            target=self.__run_loop, name="runtime-loop", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        logger.debug("Stopping runtime event loop")
+        if self.thread:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            if not self.is_loop_thread():
+                self.thread.join()
+            self.thread = None
+        self.executor.shutdown(wait=False)
+
+    def is_loop_thread(self):
+        return threading.current_thread() is self.thread
+
+    def call_soon(self, callback, *args):
+        self.loop.call_soon_threadsafe(self._run_callback, callback, args)
+
+    def call_later(self, delay_s, callback, *args):
+        return RuntimeTimer(self, delay_s, callback, args)
+
+    def call_later_in_executor(self, delay_s, function, *args):
+        return self.call_later(delay_s, self.run_in_executor, function, *args)
+
+    def run_in_executor(self, function, *args):
+        return self.executor.submit(self._run_function, function, args)
+
+    def run_coroutine(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run_sync(self, function, *args):
+        if self.is_loop_thread():
+            return function(*args)
+        # Waiting for a stopped loop would block forever
+        if not self.thread:
+            raise RuntimeError("Runtime event loop is not running")
+        future = futures.Future()
+
+        def run_function():
+            try:
+                future.set_result(function(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+        self.loop.call_soon_threadsafe(run_function)
+        return future.result()
+
+    def add_reader(self, fd, callback, *args):
+        self.run_sync(self.loop.add_reader, fd, self._run_callback, callback, args)
+
+    def remove_reader(self, fd):
+        return self.run_sync(self.loop.remove_reader, fd)
+
+    def _run_callback(self, callback, args):
+        try:
+            callback(*args)
+        except Exception as e:
+            logger.exception(f"Runtime callback '{callback.__qualname__}' failed: {e}")
+
+    def _run_function(self, function, args):
+        try:
+            return function(*args)
+        except Exception as e:
+            logger.exception(f"Runtime task '{function.__qualname__}' failed: {e}")
+            raise
+
+    def __run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        logger.debug("Runtime event loop has finished")
+
+
+class RuntimeTimer:
+
+    def __init__(self, runtime, delay_s, callback, args):
+        self.runtime = runtime
+        self.delay_s = delay_s
+        self.callback = callback
+        self.args = args
+        self.handle = None
+        self.cancelled = False
+        runtime.call_soon(self._schedule)
+
+    def cancel(self):
+        self.cancelled = True
+        self.runtime.call_soon(self._cancel_handle)
+
+    def _schedule(self):
+        if not self.cancelled:
+            self.handle = self.runtime.loop.call_later(self.delay_s, self._fire)
+
+    def _fire(self):
+        if not self.cancelled:
+            self.runtime._run_callback(self.callback, self.args)
+
+    def _cancel_handle(self):
+        if self.handle:
+            self.handle.cancel()
+            self.handle = None
+
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+
+def get_runtime(executor_max_workers=Runtime.EXECUTOR_MAX_WORKERS):
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            _runtime = Runtime(executor_max_workers)
+            _runtime.start()
+        return _runtime
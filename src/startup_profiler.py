@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StartupProfiler:
+
+    def __init__(self):
+        self.start_time = time.monotonic()
+        self.phases = {}
+        self.milestones = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        phase_start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            duration_s = time.monotonic() - phase_start_time
+            with self.lock:
+                self.phases[name] = duration_s
+            logger.info(f"Startup phase '{name}' took {duration_s:.3f} seconds")
+
+    def timed(self, name, function):
+        def timed_function(*args, **kwargs):
+            with self.phase(name):
+                return function(*args, **kwargs)
+        return timed_function
+
+    def mark(self, name):
+        with self.lock:
+            if name in self.milestones:
+                return
+            elapsed_s = time.monotonic() - self.start_time
+            self.milestones[name] = elapsed_s
+        logger.info(f"Startup milestone '{name}' reached {elapsed_s:.3f} seconds after boot")
+
+    def get_report(self):
+        with self.lock:
+            return {"phases": dict(self.phases), "milestones": dict(self.milestones)}
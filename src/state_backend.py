@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+GRPC_BACKEND = "grpc"
+REST_BACKEND = "rest"
+
+
+def get_state_backend(name=GRPC_BACKEND, poll_interval_s=None):
+    # Backends are imported on demand, so the gRPC SDK is not loaded at all
+    # when the REST backend is used
+    logger.debug(f"Using '{name}' state backend")
+    if name == GRPC_BACKEND:
+        from firestore_grpc_backend import FirestoreGrpcBackend
+        return FirestoreGrpcBackend()
+    if name == REST_BACKEND:
+        from firestore_rest_backend import FirestoreRestBackend
+        return FirestoreRestBackend(poll_interval_s) if poll_interval_s else FirestoreRestBackend()
+    raise ValueError(f"Unknown state backend '{name}'")
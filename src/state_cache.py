@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class StateCache:
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.state = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.file_path) as state_file:
+                state = json.load(state_file)
+        except FileNotFoundError:
+            logger.debug(f"State file '{self.file_path}' not found")
+            state = {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"State file '{self.file_path}' could not be read: {e}")
+            state = {}
+        with self.lock:
+            self.state = state if isinstance(state, dict) else {}
+            return dict(self.state)
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self.state.get(key, default)
+
+    def update(self, **fields):
+        with self.lock:
+            if all(self.state.get(key) == value for key, value in fields.items()):
+                return
+            self.state.update(fields)
+            try:
+                self._write(self.state)
+            except (OSError, TypeError, ValueError) as e:
+                logger.error(f"State file '{self.file_path}' could not be written: {e}")
+
+    def _write(self, state):
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        fd, temp_path = tempfile.mkstemp(
+            dir=directory, prefix=".state-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as temp_file:
+                json.dump(state, temp_file)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.replace(temp_path, self.file_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        directory_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
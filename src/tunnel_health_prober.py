@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+from runtime import get_runtime
+import asyncio
+import logging
+import ssl
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TunnelHealthProber:
+
+    UP = "up"
+    LOCAL_DOWN = "local_down"
+    PUBLIC_DOWN = "public_down"
+
+    MIN_INTERVAL_S = 5
+    MAX_INTERVAL_S = 60
+    PROBE_TIMEOUT_S = 3
+    PUBLIC_PORT = 443
+    DEAD_THRESHOLD = 2
+    # Time a new tunnel needs to be routed by the boringproxy client and to
+    # get its certificate, its public failures are not counted meanwhile
+    CREATE_GRACE_TIME_S = 60
+    LAST_SEEN_REPORT_TIME_S = 300
+
+    def __init__(self, get_targets, on_status_update=lambda _: None, on_tunnel_dead=lambda _: None,
+                 min_interval_s=MIN_INTERVAL_S, max_interval_s=MAX_INTERVAL_S, probe_public=True):
+        self.get_targets = get_targets
+        self.on_status_update = on_status_update
+        self.on_tunnel_dead = on_tunnel_dead
+        self.min_interval_s = min_interval_s
+        self.max_interval_s = max(min_interval_s, max_interval_s)
+        self.probe_public = probe_public
+        self.runtime = get_runtime()
+        self.interval_s = min_interval_s
+        self.statuses = {}
+        self.failure_counts = {}
+        self.last_seen_report_times = {}
+        self.create_times = {}
+        self.running = False
+        self.probe_timer = None
+        self.probe_task = None
+        # Only the routing through the boringproxy server is checked, the
+        # certificate is validated by the real clients
+        self.ssl_context = ssl.create_default_context()
+        self.ssl_context.check_hostname = False
+        self.ssl_context.verify_mode = ssl.CERT_NONE
+
+    def start(self):
+        logger.debug("Starting tunnel health prober")
+        self.running = True
+        self.runtime.call_soon(self._schedule_probe, 0)
+
+    def stop(self):
+        logger.debug("Stopping tunnel health prober")
+        self.running = False
+        self.runtime.call_soon(self._cancel_probe)
+
+    def trigger(self):
+        self.interval_s = self.min_interval_s
+        self.runtime.call_soon(self._schedule_probe, 0)
+
+    def on_tunnel_created(self, port):
+        self.runtime.call_soon(self._reset_port, port, time.monotonic())
+
+    def _reset_port(self, port, create_time):
+        self.create_times[port] = create_time
+        self.failure_counts[port] = 0
+
+    def _schedule_probe(self, delay_s):
+        if self.probe_timer:
+            self.probe_timer.cancel()
+            self.probe_timer = None
+        if self.running and not self.probe_task:
+            self.probe_timer = self.runtime.loop.call_later(delay_s, self._start_probe)
+
+    def _cancel_probe(self):
+        if self.probe_timer:
+            self.probe_timer.cancel()
+            self.probe_timer = None
+        if self.probe_task:
+            self.probe_task.cancel()
+
+    def _start_probe(self):
+        self.probe_timer = None
+        self.probe_task = self.runtime.loop.create_task(self._probe_tunnels())
+        self.probe_task.add_done_callback(self._on_probe_done)
+
+    def _on_probe_done(self, task):
+        self.probe_task = None
+        if not task.cancelled() and task.exception():
+            logger.error(f"Tunnels health probe failed: {task.exception()}")
+        self._schedule_probe(self.interval_s)
+
+    async def _probe_tunnels(self):
+        targets = self.get_targets()
+        ports = list(targets)
+        results = await asyncio.gather(*(self._probe_tunnel(targets[port]["url"], targets[port]["client_addr"], port)
+                                         for port in ports))
+        now = time.time()
+        now_monotonic = time.monotonic()
+        # Expired grace periods are dropped, the ports being created while probing are kept
+        self.create_times = {port: create_time for port, create_time in self.create_times.items()
+                             if now_monotonic - create_time < self.CREATE_GRACE_TIME_S}
+        statuses, dead_ports, changed = {}, [], False
+        for port, status in zip(ports, results):
+            status_changed = self.statuses.get(port) != status
+            changed = changed or status_changed
+            self.statuses[port] = status
+            if status_changed:
+                statuses[port] = {"status": status}
+            if status == self.UP:
+                self.failure_counts[port] = 0
+                if now - self.last_seen_report_times.get(port, 0) >= self.LAST_SEEN_REPORT_TIME_S or status_changed:
+                    self.last_seen_report_times[port] = now
+                    statuses[port] = {"status": status, "last_seen": int(now)}
+                continue
+            if status == self.PUBLIC_DOWN and port not in self.create_times:
+                self.failure_counts[port] = self.failure_counts.get(port, 0) + 1
+                if self.failure_counts[port] >= self.DEAD_THRESHOLD:
+                    self.failure_counts[port] = 0
+                    dead_ports.append(port)
+        for port in set(self.statuses) - set(ports):
+            for port_state in (self.statuses, self.failure_counts, self.last_seen_report_times):
+                port_state.pop(port, None)
+
+        stable = not changed and not any(self.failure_counts.values())
+        self.interval_s = min(self.interval_s * 2, self.max_interval_s) if stable else self.min_interval_s
+        if statuses:
+            self.runtime.run_in_executor(self.on_status_update, statuses)
+        for port in dead_ports:
+            logger.warning(f"Tunnel for port '{port}' is not reachable from the public endpoint")
+            self.runtime.run_in_executor(self.on_tunnel_dead, port)
+
+    async def _probe_tunnel(self, url, client_addr, port):
+        if not await self._check_connection(client_addr, int(port)):
+            return self.LOCAL_DOWN
+        if not self.probe_public or not url:
+            return self.UP
+        if not await self._check_connection(url, self.PUBLIC_PORT, self.ssl_context):
+            return self.PUBLIC_DOWN
+        return self.UP
+
+    async def _check_connection(self, host, port, ssl_context=None):
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port, ssl=ssl_context), self.PROBE_TIMEOUT_S)
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.debug(f"Connection to '{host}:{port}' failed: {e!r}")
+            return False
+        writer.close()
+        return True
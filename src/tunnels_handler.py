@@ -1,11 +1,31 @@
 #!/usr/bin/env python3
 
-from boringproxy_api import BoringproxyUserAPI
-from boringproxy_local_client import BoringproxyLocalClient
+from boringproxy_registry import get_boringproxy_registry
+from concurrent import futures
+from metrics import METRICS
+from reconcile_journal import ReconcileJournal
+from runtime import get_runtime
+from tunnel_health_prober import TunnelHealthProber
+from tunnels_provisioner import TunnelsProvisioner
+from tunnels_reconciler import TunnelsReconciler
 import logging
+import requests
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+BP_API_CALL_DURATION = METRICS.histogram(
+    "iombian_tunnels_bp_api_call_duration_seconds", "Duration of the boringproxy API calls", ["method"])
+RECONCILE_DURATION = METRICS.histogram(
+    "iombian_tunnels_reconcile_duration_seconds", "Duration of the tunnels reconciles")
+ACTIVE_TUNNELS = METRICS.gauge(
+    "iombian_tunnels_active_tunnels", "Number of tunnels active in the boringproxy server", ["device"])
+DEAD_TUNNEL_RECREATIONS = METRICS.counter(
+    "iombian_tunnels_dead_tunnel_recreations_total", "Tunnels recreated after failing the health probes")
+RECOVERED_OPERATIONS = METRICS.counter(
+    "iombian_tunnels_journal_recovered_operations_total", "Incomplete journal operations recovered at startup", ["operation"])
+
 
 class TunnelsHandler():
 
@@ -16,64 +36,279 @@ class TunnelsHandler():
         "wetty": {"tunnel_port": "Random", "client_addr": "127.0.0.1", "tls_termination": "client", "allow_external_tcp": False, "password_protect": False, "username": None, "password": None},
     }
 
-    def __init__(self, service_host, service_token, username, device_name, tunnel_name_generator):
+    PROVISIONING_MAX_WORKERS = 4
+    DEAD_TUNNEL_RECREATE_MIN_TIME_S = 60
+
+    def __init__(self, service_host, service_token, username, device_name, tunnel_name_generator, provisioning_max_workers=PROVISIONING_MAX_WORKERS, registry=None, health_prober_options=None, journal=None):
         self.service_host = service_host
         self.service_token = service_token
         self.username = username
         self.device_name = device_name
         self.tunnel_name_generator = tunnel_name_generator
+        self.runtime = get_runtime()
         self.active_tunnels = {}
-        self.bp_api_user = BoringproxyUserAPI(
-            service_host, username, service_token)
+        self.bp_api_user = None
         self.bp_api_client = None
-        self.bp_local_client = BoringproxyLocalClient(
+        self.api_client_lock = threading.Lock()
+        self.registry = registry if registry else get_boringproxy_registry()
+        self.bp_local_client = self.registry.acquire_local_client(
             service_host, service_token, device_name)
         self.tunnel_available_callback = None
+        self.tunnel_status_callback = None
+        self.reconciler = TunnelsReconciler(self._get_tunnel_spec)
+        self.provisioner = TunnelsProvisioner(provisioning_max_workers)
+        self.health_prober = TunnelHealthProber(
+            self._get_probe_targets, self._on_tunnels_status, self._on_tunnel_dead, **(health_prober_options or {}))
+        self.recreate_times = {}
+        self.desired_tunnels = {}
+        self.journal = journal
+        self.journal_recovered = False
+        self.pending_publishes = {}
+        self.pending_publishes_lock = threading.Lock()
 
     def start(self):
-        if not self.bp_api_client:
-            self.bp_api_client = self.bp_api_user.create_client(
-                self.device_name)
         self.bp_local_client.start()
+        self.health_prober.start()
+        # The boringproxy API can take long to reach, the startup does not
+        # wait for it (the reconciles do)
+        self.runtime.run_in_executor(self._initialize_api_client)
 
     def stop(self):
-        self.bp_local_client.stop()
+        self.health_prober.stop()
+        self.provisioner.stop()
+        if self.registry.release_local_client(self.bp_local_client):
+            self.bp_local_client.stop()
 
     def add_tunnel_available_callback(self, callback):
         self.tunnel_available_callback = callback
 
+    def add_tunnel_status_callback(self, callback):
+        self.tunnel_status_callback = callback
+
+    def load_state(self, actual_tunnels):
+        self.reconciler.load_state(actual_tunnels)
+        self.active_tunnels = self.reconciler.get_active_tunnels()
+
+    def get_state(self):
+        return self.reconciler.get_state()
+
     def on_tunnels_update(self, tunnels):
-        self.active_tunnels = self.bp_api_client.get_tunnels()
-        for tunnel_port, tunnel_info in tunnels.items():
-            if tunnel_port in self.active_tunnels:
-                tunnel_url = tunnel_info.get("url")
-                active_tunnel_url = self.active_tunnels.get(tunnel_port)
-                if tunnel_url == active_tunnel_url:
-                    logger.debug(
-                        f"Tunnel for port '{tunnel_port}' already active and published")
-                else:
-                    logger.debug(
-                        f"Tunnel for port '{tunnel_port}' is unpublished")
-                    self._announce_tunnel_availability(
-                        tunnel_port, active_tunnel_url)
-                continue
+        with RECONCILE_DURATION.time():
+            self._reconcile_tunnels(tunnels)
+        ACTIVE_TUNNELS.set(len(self.active_tunnels), device=self.device_name)
+
+    def _reconcile_tunnels(self, tunnels):
+        self.desired_tunnels = tunnels
+        self._drop_publishes(tunnels)
+        if not self._initialize_api_client():
+            logger.error("Boringproxy API not available, cannot update the tunnels")
+            return
+        if self.reconciler.needs_refresh:
+            self._refresh_active_tunnels()
+        diff = self.reconciler.compute_diff(tunnels)
+        if diff.is_empty():
+            logger.debug("Tunnels already active and published")
+            return
+        logger.debug(f"Applying tunnels diff: {diff}")
+        operations = []
+        for tunnel_port in diff.removed:
+            logger.debug(
+                f"Active tunnel for port '{tunnel_port}' not needed")
+            operations.append(self.provisioner.submit(
+                tunnel_port, self._delete_tunnel, tunnel_port))
+        for tunnel_port, tunnel_spec in diff.changed.items():
+            logger.debug(
+                f"Tunnel for port '{tunnel_port}' has changed, recreating it")
+            operations.append(self.provisioner.submit(
+                tunnel_port, self._recreate_tunnel, tunnel_port, tunnel_spec))
+        for tunnel_port, tunnel_spec in diff.added.items():
             logger.debug(f"We must create a tunnel for port {tunnel_port}")
-            tunnel_type = tunnel_info.get("type")
-            subdomain = self.tunnel_name_generator.create_service_name(
-                tunnel_type)
-            domain = f"{subdomain}.{self.service_host}"
-            tunnel_options = self.TUNNEL_OPTIONS_BY_TYPE.get(
-                tunnel_type, self.DEFAULT_TUNNEL_OPTIONS)
-            url = self.bp_api_client.create_tunnel(domain,
-                                                   tunnel_port, **tunnel_options)
-            self._announce_tunnel_availability(
-                tunnel_port, url)
-        for active_tunnel_port in self.active_tunnels.keys():
-            if active_tunnel_port not in tunnels:
-                logger.debug(
-                    f"Active tunnel for port '{active_tunnel_port}' not needed")
-                self.bp_api_client.delete_tunnel(active_tunnel_port)
+            operations.append(self.provisioner.submit(
+                tunnel_port, self._create_tunnel, tunnel_port, tunnel_spec))
+        for tunnel_port, tunnel_url in diff.unpublished.items():
+            logger.debug(f"Tunnel for port '{tunnel_port}' is unpublished")
+            self._announce_tunnel_availability(tunnel_port, tunnel_url)
+        futures.wait(operations)
+        self.active_tunnels = self.reconciler.get_active_tunnels()
+        if not self.reconciler.needs_refresh:
+            self.bp_api_client.registered_tunnels = dict(self.active_tunnels)
+
+    def _initialize_api_client(self):
+        # The reconciles, the dead tunnel recreations and the startup can all
+        # initialize the client, the journal must be recovered only once
+        with self.api_client_lock:
+            if self.bp_api_client:
+                return True
+            return self._create_api_client()
+
+    def _create_api_client(self):
+        try:
+            if not self.bp_api_user:
+                with BP_API_CALL_DURATION.time(method="get_clients"):
+                    self.bp_api_user = self.registry.get_user_api(
+                        self.service_host, self.username, self.service_token)
+            with BP_API_CALL_DURATION.time(method="create_client"):
+                self.bp_api_client = self.registry.create_client(
+                    self.bp_api_user, self.device_name)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Boringproxy API not reachable: {e}")
+            return False
+        if not self.bp_api_client:
+            return False
+        self.reconciler.refresh(self.bp_api_client.registered_tunnels)
+        self._recover_journal()
+        self.active_tunnels = self.reconciler.get_active_tunnels()
+        return True
+
+    def _refresh_active_tunnels(self):
+        with BP_API_CALL_DURATION.time(method="get_tunnels"):
+            server_tunnels = self.bp_api_client.get_tunnels()
+        self.bp_api_client.registered_tunnels = server_tunnels
+        self.reconciler.refresh(server_tunnels)
+        self.active_tunnels = self.reconciler.get_active_tunnels()
+
+    def _get_tunnel_spec(self, tunnel_info):
+        tunnel_type = tunnel_info.get("type")
+        subdomain = self.tunnel_name_generator.create_service_name(
+            tunnel_type)
+        domain = f"{subdomain}.{self.service_host}"
+        tunnel_options = self.TUNNEL_OPTIONS_BY_TYPE.get(
+            tunnel_type, self.DEFAULT_TUNNEL_OPTIONS)
+        return {"domain": domain, "options": tunnel_options}
+
+    def _create_tunnel(self, tunnel_port, tunnel_spec):
+        entry_id = self._begin_operation(
+            ReconcileJournal.CREATE, tunnel_port, domain=tunnel_spec["domain"], options=tunnel_spec["options"])
+        try:
+            with BP_API_CALL_DURATION.time(method="create_tunnel"):
+                url = self.bp_api_client.create_tunnel(tunnel_spec["domain"],
+                                                       tunnel_port, **tunnel_spec["options"])
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Boringproxy API not reachable: {e}")
+            url = None
+        if not url:
+            logger.error(f"Tunnel for port '{tunnel_port}' could not be created")
+            self.reconciler.invalidate()
+            self._complete_operation(entry_id)
+            return
+        self.reconciler.mark_created(tunnel_port, url, tunnel_spec)
+        self._complete_operation(entry_id)
+        self.health_prober.on_tunnel_created(tunnel_port)
+        self._announce_tunnel_availability(tunnel_port, url)
+        return url
+
+    def _recreate_tunnel(self, tunnel_port, tunnel_spec):
+        if self._delete_tunnel(tunnel_port):
+            return self._create_tunnel(tunnel_port, tunnel_spec)
+
+    def _delete_tunnel(self, tunnel_port):
+        entry_id = self._begin_operation(
+            ReconcileJournal.DELETE, tunnel_port, url=self.reconciler.get_active_tunnels().get(tunnel_port))
+        try:
+            with BP_API_CALL_DURATION.time(method="delete_tunnel"):
+                deleted = self.bp_api_client.delete_tunnel(tunnel_port)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Boringproxy API not reachable: {e}")
+            deleted = False
+        if not deleted:
+            logger.error(f"Tunnel for port '{tunnel_port}' could not be deleted")
+            self.reconciler.invalidate()
+            self._complete_operation(entry_id)
+            return False
+        self.reconciler.mark_deleted(tunnel_port)
+        self._complete_operation(entry_id)
+        return True
 
     def _announce_tunnel_availability(self, port, url):
+        entry_id = None
+        if self.journal:
+            with self.pending_publishes_lock:
+                entry_id, pending_url = self.pending_publishes.get(port, (None, None))
+                if pending_url != url:
+                    self._complete_operation(entry_id)
+                    entry_id = self._begin_operation(ReconcileJournal.PUBLISH, port, url=url)
+                    self.pending_publishes[port] = (entry_id, url)
+        published = None
         if self.tunnel_available_callback:
-            self.tunnel_available_callback({"url": url, "port": port})
+            published = self.tunnel_available_callback({"url": url, "port": port})
+        # The callback returns a future once the URL is being written, the
+        # publication is complete when the write succeeds
+        if entry_id is not None and published:
+            published.add_done_callback(lambda _: self._complete_publish(port, entry_id))
+        self.health_prober.trigger()
+
+    def _get_probe_targets(self):
+        return {port: {"url": actual["url"], "client_addr": (actual["options"] or self.DEFAULT_TUNNEL_OPTIONS)["client_addr"]}
+                for port, actual in self.reconciler.get_state().items()}
+
+    def _on_tunnels_status(self, tunnels_status):
+        if self.tunnel_status_callback:
+            self.tunnel_status_callback(tunnels_status)
+
+    def _on_tunnel_dead(self, tunnel_port):
+        now = time.monotonic()
+        if now - self.recreate_times.get(tunnel_port, -self.DEAD_TUNNEL_RECREATE_MIN_TIME_S) < self.DEAD_TUNNEL_RECREATE_MIN_TIME_S:
+            logger.debug(f"Tunnel for port '{tunnel_port}' recently recreated, waiting")
+            return
+        # The options of the tunnels read from the server are not known, the
+        # spec is built again from the desired tunnel
+        tunnel_info = self.desired_tunnels.get(tunnel_port)
+        if not tunnel_info or tunnel_port not in self.reconciler.get_state():
+            logger.debug(f"Tunnel for port '{tunnel_port}' is not desired, leaving it to the reconcile")
+            return
+        if not self._initialize_api_client():
+            return
+        self.recreate_times[tunnel_port] = now
+        logger.warning(f"Recreating dead tunnel for port '{tunnel_port}'")
+        DEAD_TUNNEL_RECREATIONS.inc()
+        tunnel_spec = self._get_tunnel_spec(tunnel_info)
+        self.provisioner.submit(tunnel_port, self._recreate_tunnel, tunnel_port, tunnel_spec)
+
+    def _begin_operation(self, operation, tunnel_port, **data):
+        if not self.journal:
+            return None
+        return self.journal.begin(operation, self.device_name, tunnel_port, **data)
+
+    def _complete_operation(self, entry_id):
+        if entry_id is not None:
+            self.journal.complete(entry_id)
+
+    def _complete_publish(self, port, entry_id):
+        with self.pending_publishes_lock:
+            if self.pending_publishes.get(port, (None, None))[0] != entry_id:
+                return
+            del self.pending_publishes[port]
+        self._complete_operation(entry_id)
+
+    def _drop_publishes(self, tunnels):
+        # The tunnels removed from the document do not need to be published
+        with self.pending_publishes_lock:
+            for port, (entry_id, url) in list(self.pending_publishes.items()):
+                if port not in tunnels:
+                    self._complete_operation(entry_id)
+                    del self.pending_publishes[port]
+
+    def _recover_journal(self):
+        if not self.journal or self.journal_recovered:
+            return
+        self.journal_recovered = True
+        entries = self.journal.get_pending(self.device_name)
+        if entries:
+            logger.info(f"Recovering {len(entries)} tunnel operations interrupted by the last shutdown")
+        # The actual tunnels have just been read from the server, only the
+        # operations that were in flight are checked against them
+        for entry in entries:
+            tunnel_port, operation = entry["port"], entry["op"]
+            actual = self.reconciler.get_state().get(tunnel_port)
+            if operation == ReconcileJournal.CREATE and actual and actual["url"] == entry["domain"]:
+                logger.debug(f"Tunnel for port '{tunnel_port}' was created but not published, adopting it")
+                self.reconciler.mark_created(tunnel_port, actual["url"], {"options": entry["options"]})
+                self._announce_tunnel_availability(tunnel_port, actual["url"])
+            elif operation == ReconcileJournal.DELETE and actual and actual["url"] == entry["url"]:
+                logger.debug(f"Deletion of the tunnel for port '{tunnel_port}' was interrupted, deleting it")
+                self._delete_tunnel(tunnel_port)
+            elif operation == ReconcileJournal.PUBLISH and actual and actual["url"] == entry["url"]:
+                logger.debug(f"Publication of the tunnel for port '{tunnel_port}' was interrupted, publishing it")
+                self._announce_tunnel_availability(tunnel_port, actual["url"])
+            RECOVERED_OPERATIONS.inc(operation=operation)
+            self.journal.complete(entry["id"])
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class TunnelsProvisioner:
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        # The reconciles wait for these operations from the runtime executor,
+        # running them on that same executor could exhaust it and deadlock
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="tunnels-provisioner")
+        self.port_queues = {}
+        self.lock = threading.Lock()
+
+    def submit(self, port, operation, *args):
+        future = Future()
+        with self.lock:
+            port_queue = self.port_queues.get(port)
+            if port_queue is not None:
+                port_queue.append((future, operation, args))
+                return future
+            self.port_queues[port] = deque([(future, operation, args)])
+        self.executor.submit(self._run_port_queue, port)
+        return future
+
+    def stop(self):
+        logger.debug("Stopping tunnels provisioner")
+        with self.lock:
+            for port_queue in self.port_queues.values():
+                for future, _, _ in port_queue:
+                    future.cancel()
+        self.executor.shutdown(wait=False)
+
+    def _run_port_queue(self, port):
+        while True:
+            with self.lock:
+                port_queue = self.port_queues[port]
+                if not port_queue:
+                    del self.port_queues[port]
+                    return
+                future, operation, args = port_queue.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(operation(*args))
+            except Exception as e:
+                logger.error(
+                    f"Provisioning operation for port '{port}' failed: {e}")
+                future.set_exception(e)
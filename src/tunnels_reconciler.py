@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class TunnelsDiff:
+
+    def __init__(self):
+        self.added = {}
+        self.removed = []
+        self.changed = {}
+        self.unpublished = {}
+
+    def is_empty(self):
+        return not (self.added or self.removed or self.changed or self.unpublished)
+
+    def __repr__(self):
+        return (f"TunnelsDiff(added={list(self.added)}, removed={self.removed}, "
+                f"changed={list(self.changed)}, unpublished={list(self.unpublished)})")
+
+
+class TunnelsReconciler:
+
+    def __init__(self, tunnel_spec_builder):
+        self.tunnel_spec_builder = tunnel_spec_builder
+        self.actual_tunnels = {}
+        self.needs_refresh = True
+        self.lock = threading.Lock()
+
+    def refresh(self, server_tunnels):
+        logger.debug(f"Refreshing actual tunnels model: {server_tunnels}")
+        with self.lock:
+            actual_tunnels = {}
+            for port, url in server_tunnels.items():
+                known = self.actual_tunnels.get(port)
+                options = known["options"] if known and known["url"] == url else None
+                actual_tunnels[port] = {"url": url, "options": options}
+            self.actual_tunnels = actual_tunnels
+            self.needs_refresh = False
+
+    def load_state(self, actual_tunnels):
+        logger.debug(f"Loading cached tunnels model: {actual_tunnels}")
+        with self.lock:
+            self.actual_tunnels = {port: dict(actual)
+                                   for port, actual in actual_tunnels.items()}
+            self.needs_refresh = True
+
+    def get_state(self):
+        with self.lock:
+            return {port: dict(actual) for port, actual in self.actual_tunnels.items()}
+
+    def invalidate(self):
+        self.needs_refresh = True
+
+    def compute_diff(self, tunnels):
+        diff = TunnelsDiff()
+        with self.lock:
+            actual_tunnels = dict(self.actual_tunnels)
+        for port, tunnel_info in tunnels.items():
+            spec = self.tunnel_spec_builder(tunnel_info)
+            actual = actual_tunnels.get(port)
+            if actual is None:
+                diff.added[port] = spec
+            elif actual["url"] != spec["domain"] or (actual["options"] is not None and actual["options"] != spec["options"]):
+                diff.changed[port] = spec
+            elif tunnel_info.get("url") != actual["url"]:
+                diff.unpublished[port] = actual["url"]
+        for port in actual_tunnels.keys():
+            if port not in tunnels:
+                diff.removed.append(port)
+        return diff
+
+    def mark_created(self, port, url, spec):
+        with self.lock:
+            self.actual_tunnels[port] = {"url": url, "options": spec["options"]}
+
+    def mark_deleted(self, port):
+        with self.lock:
+            self.actual_tunnels.pop(port, None)
+
+    def get_active_tunnels(self):
+        with self.lock:
+            return {port: actual["url"] for port, actual in self.actual_tunnels.items()}
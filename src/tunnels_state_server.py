@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+from collections import deque
+import json
+import logging
+import os
+import threading
+import zmq
+
+logger = logging.getLogger(__name__)
+
+
+class TunnelsStateServer:
+
+    QUERY_ENDPOINT = "tcp://127.0.0.1:5560"
+    PUBLISH_ENDPOINT = "tcp://127.0.0.1:5561"
+
+    def __init__(self, query_endpoint=QUERY_ENDPOINT, publish_endpoint=PUBLISH_ENDPOINT):
+        self.query_endpoint = query_endpoint
+        self.publish_endpoint = publish_endpoint
+        self.context = zmq.Context()
+        self.query_socket = None
+        self.publish_socket = None
+        self.devices = {}
+        self.views = {}
+        self.outgoing_messages = deque()
+        self.running = False
+        self.io_thread = None
+        self.lock = threading.Lock()
+        self.wakeup_reader, self.wakeup_writer = os.pipe()
+        os.set_blocking(self.wakeup_reader, False)
+        os.set_blocking(self.wakeup_writer, False)
+        self.commands = {"get_devices": self.get_devices,
+                         "get_tunnels": self.get_tunnels,
+                         "get_tunnel": self.get_tunnel}
+
+    def start(self):
+        logger.debug(f"Starting tunnels state server ('{self.query_endpoint}', '{self.publish_endpoint}')")
+        try:
+            self.query_socket = self.context.socket(zmq.ROUTER)
+            self.query_socket.setsockopt(zmq.LINGER, 0)
+            self.query_socket.bind(self.query_endpoint)
+            self.publish_socket = self.context.socket(zmq.PUB)
+            self.publish_socket.setsockopt(zmq.LINGER, 0)
+            self.publish_socket.bind(self.publish_endpoint)
+        except zmq.ZMQError as e:
+            logger.error(f"Tunnels state server could not be started: {e}")
+            self._close_sockets()
+            return
+        self.running = True
+        self.io_thread = threading.Thread(
+            target=self.__io_loop, name="tunnels-state-server", daemon=True)
+        self.io_thread.start()
+
+    def stop(self):
+        logger.debug("Stopping tunnels state server")
+        self.running = False
+        self._wakeup()
+        if self.io_thread:
+            self.io_thread.join()
+            self.io_thread = None
+        self._close_sockets()
+        self.context.term()
+        os.close(self.wakeup_reader)
+        os.close(self.wakeup_writer)
+
+    def update_device(self, device_id, tunnels=None, active_tunnels=None):
+        with self.lock:
+            device = self._get_device(device_id)
+            if tunnels is not None:
+                device["tunnels"] = {port: dict(tunnel_info) for port, tunnel_info in tunnels.items()}
+            if active_tunnels is not None:
+                device["active_tunnels"] = dict(active_tunnels)
+            self._refresh_view(device_id)
+
+    def update_tunnel_url(self, device_id, port, url):
+        with self.lock:
+            self._get_device(device_id)["active_tunnels"][port] = url
+            self._refresh_view(device_id)
+
+    def update_tunnels_status(self, device_id, tunnels_status):
+        with self.lock:
+            statuses = self._get_device(device_id)["statuses"]
+            for port, tunnel_status in tunnels_status.items():
+                statuses.setdefault(port, {}).update(tunnel_status)
+            self._refresh_view(device_id)
+
+    def get_devices(self):
+        with self.lock:
+            return list(self.views)
+
+    def get_tunnels(self, device_id=None):
+        with self.lock:
+            view = self.views.get(self._get_device_id(device_id))
+            return {port: dict(tunnel) for port, tunnel in view.items()} if view is not None else None
+
+    def get_tunnel(self, port, device_id=None):
+        with self.lock:
+            tunnel = self.views.get(self._get_device_id(device_id), {}).get(str(port))
+            return dict(tunnel) if tunnel is not None else None
+
+    def _get_device(self, device_id):
+        return self.devices.setdefault(device_id, {"tunnels": {}, "active_tunnels": {}, "statuses": {}})
+
+    def _get_device_id(self, device_id):
+        # The device can be omitted when only one is handled (not in gateway mode)
+        if device_id is None and len(self.views) == 1:
+            return next(iter(self.views))
+        return device_id
+
+    def _refresh_view(self, device_id):
+        device = self.devices[device_id]
+        view = {}
+        for port in set(device["tunnels"]) | set(device["active_tunnels"]):
+            tunnel = dict(device["tunnels"].get(port, {}))
+            tunnel.update(device["statuses"].get(port, {}))
+            tunnel["url"] = device["active_tunnels"].get(port)
+            view[port] = tunnel
+        for port in set(device["statuses"]) - set(view):
+            del device["statuses"][port]
+        previous_view = self.views.get(device_id, {})
+        self.views[device_id] = view
+        changed_ports = [port for port in set(view) | set(previous_view) if view.get(port) != previous_view.get(port)]
+        # Nothing is published when the server could not be started
+        if not changed_ports or not self.running:
+            return
+        for port in sorted(changed_ports):
+            message = {"device_id": device_id, "port": port, "tunnel": view.get(port)}
+            self.outgoing_messages.append([device_id.encode(), json.dumps(message).encode()])
+        self._wakeup()
+
+    def _handle_request(self, frames):
+        # Requests are routed back with their envelope, so REQ and DEALER clients are served alike
+        *envelope, payload = frames
+        try:
+            request = json.loads(payload)
+            command = self.commands.get(request.get("command"))
+            if not command:
+                response = {"error": f"Unknown command '{request.get('command')}'"}
+            else:
+                response = command(**(request.get("params") or {}))
+        except (AttributeError, TypeError, ValueError) as e:
+            logger.warning(f"Invalid request received: {e}")
+            response = {"error": f"Invalid request: {e}"}
+        try:
+            self.query_socket.send_multipart(envelope + [json.dumps(response).encode()], zmq.NOBLOCK)
+        except zmq.ZMQError as e:
+            logger.debug(f"Response could not be sent: {e}")
+
+    def _close_sockets(self):
+        for socket in (self.query_socket, self.publish_socket):
+            if socket:
+                socket.close(linger=0)
+        self.query_socket, self.publish_socket = None, None
+
+    def _wakeup(self):
+        try:
+            os.write(self.wakeup_writer, b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def __io_loop(self):
+        poller = zmq.Poller()
+        poller.register(self.query_socket, zmq.POLLIN)
+        poller.register(self.wakeup_reader, zmq.POLLIN)
+        while self.running:
+            events = dict(poller.poll())
+            if self.wakeup_reader in events:
+                try:
+                    os.read(self.wakeup_reader, 4096)
+                except BlockingIOError:
+                    pass
+            while True:
+                with self.lock:
+                    if not self.outgoing_messages:
+                        break
+                    frames = self.outgoing_messages.popleft()
+                try:
+                    self.publish_socket.send_multipart(frames, zmq.NOBLOCK)
+                except zmq.Again:
+                    logger.debug("Tunnel state change dropped, subscribers are not keeping up")
+            while True:
+                try:
+                    frames = self.query_socket.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                self._handle_request(frames)
+        logger.debug("Tunnels state server I/O loop has finished")